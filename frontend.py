@@ -16,8 +16,10 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import time
+STARTED = time.monotonic()
 import configparser
-from gi.repository import GObject
+from gi.repository import Gio, GObject
 import dbus
 import dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
@@ -26,79 +28,275 @@ import itertools
 import logging
 from optparse import OptionParser
 import os
-import time
 import signal
 import shlex
 import subprocess
 import sys
 from dbus2vdr import DBus2VDR
+from frontends import get_backend, import_times
 from frontends.base import vdrFrontend
-from frontends.Softhddevice import Softhddevice
-from frontends.kodi import KODI
-from frontends.xineliboutput import VDRsxfe
-from frontends.xine import Xine
-from tools.lirc_socket import lircConnection
+from tools.remote import RemoteControl
+from tools.background import BackgroundRenderer
+from tools.executor import Executor
+from tools.logger import LogManager
+from tools.metrics import Metrics, PrometheusWriter
+from tools.processes import ProcessSupervisor
+from tools.sound import SoundDeviceWatcher
+from tools.transitions import PENDING, TransitionScheduler
+IMPORTED = time.monotonic()
+log = logging.getLogger('frontend')
 
 
-class Main(dbus.service.Object):
-    def __init__(self, options):
+class FrontendService:
+    """owns the bus name and the helpers shared by all vdr instances and
+    runs one Main (frontend manager) per instance"""
+    def __init__(self, options, bus=None):
         self.options = options
-        self.bus = dbus.SystemBus()
-        bus_name = dbus.service.BusName('de.yavdr.frontend', bus=self.bus)
-        dbus.service.Object.__init__(self, bus_name, '/frontend')
+        self.bus = bus or dbus.SystemBus()
+        self.bus_name = dbus.service.BusName('de.yavdr.frontend',
+                                             bus=self.bus)
+        self.name_acquired = time.monotonic()
         self.settings = Settings(self.options.config)
-        logging.debug("read settings from {0}".format(self.options.config))
-        logging.debug("starting frontend script")
+        log.debug("read settings from %s", self.options.config)
+        self.executor = Executor(
+            self.settings.get_settingi('Frontend', 'workers', 2))
+        self.background = BackgroundRenderer(
+            self.executor,
+            self.settings.get_settingi('Frontend', 'bg_cache_size', 4))
+        signal.signal(signal.SIGTERM, self.sigint)
+        signal.signal(signal.SIGINT, self.sigint)
+        self.managers = {}
+        for instance in self.settings.instances:
+            self.managers[instance] = self.create_manager(instance)
+        prometheus_file = self.settings.get_setting('Metrics',
+                                                    'prometheus_file', None)
+        if prometheus_file:
+            self.prometheus = PrometheusWriter(
+                prometheus_file,
+                [manager.metrics for manager in self.managers.values()],
+                self.settings.get_settingi('Metrics', 'interval', 60))
+        self.initialized = time.monotonic()
+        if self.options.profile_startup:
+            self.profile_startup()
+
+    def create_manager(self, instance):
+        return Main(self, instance)
+
+    def profile_startup(self):
+        report = ["startup profile:",
+                  "  imports:          {0:.3f} s".format(IMPORTED - STARTED)]
+        for module, duration in sorted(import_times.items()):
+            report.append("    {0:<16} {1:.3f} s".format(module, duration))
+        report.append("  bus name owned:   {0:.3f} s".format(
+            self.name_acquired - STARTED))
+        for instance, manager in sorted(self.managers.items()):
+            report.append("  instance {0}:".format(instance))
+            for phase in ('startup_dbus2vdr', 'startup_plugins',
+                          'startup_frontends', 'startup_attach'):
+                histogram = manager.metrics.histograms.get(phase)
+                if histogram:
+                    report.append("    {0:<16} {1:.3f} s".format(
+                        phase[8:], histogram.sum))
+        report.append("  init done:        {0:.3f} s".format(
+            self.initialized - STARTED))
+        print("\n".join(report), file=sys.stderr)
+
+    def shutdown(self):
+        for manager in self.managers.values():
+            manager.shutdown()
+
+    def quit(self):
+        log.info("quit frontend script")
+        self.shutdown()
+        self.executor.shutdown()
+        self.loop.quit()
+        self.settings.log_manager.stop()
+        sys.exit()
+
+    def sigint(self, signal, *args, **kwargs):
+        log.info("got %s", signal)
+        self.shutdown()
+        time.sleep(1)
+        self.loop.quit()
+        self.settings.log_manager.stop()
+        sys.exit()
+
+
+class Main(dbus.service.Object):
+    """frontend manager of a single vdr instance"""
+    # instance 0 is also exported on the old object path /frontend
+    SUPPORTS_MULTIPLE_OBJECT_PATHS = True
+
+    def __init__(self, service, instance=0):
+        self.service = service
+        self.instance = instance
+        self.options = service.options
+        self.bus = service.bus
+        self.path = '/frontend/{0}'.format(instance)
+        dbus.service.Object.__init__(self, service.bus_name, self.path)
+        if instance == 0:
+            self.add_to_connection(self.bus, '/frontend')
+        self.settings = InstanceSettings(service.settings, instance)
+        self.executor = service.executor
+        self.background = service.background
+        # every instance has its own display, so child processes get
+        # their environment from here instead of os.environ
+        self.env = dict(os.environ)
+        self.env['DISPLAY'] = self.settings.get_display(
+            self.settings.get_setting('Frontend', 'DISPLAY', ":0"))
+        log.debug("instance %s: DISPLAY is %s", instance,
+                  self.env['DISPLAY'])
+        self.bg_proc = None
+        self.bg_pending = None
+        self.preload_backgrounds()
+        self.metrics = Metrics(instance)
+        self.processes = ProcessSupervisor(self.metrics)
+        log.debug("starting frontend manager for vdr instance %s",
+                  instance)
         # track vdr status changes
-        self.dbus2vdr = DBus2VDR(dbus.SystemBus(), instance=0, watchdog=True)
+        self.dbus2vdr = self.connect_dbus2vdr(watchdog=True)
         # bind function to Signal "Ready"
         self.dbus2vdr.onSignal("Ready", self.onStart)
         # bind function to Signal "Stop"
         self.dbus2vdr.onSignal("Stop", self.onStop)
+        self.dbus2vdr_owner = self.get_vdr_owner()
+        self.vdr_pid = (None, None)  # (bus name owner, its pid)
+        self.plugins = None
         self.vdrDBusSignal()
         self.current = None
         self.external = False
         self.vdrStatus = 0
         self.wants_shutdown = False
         self.expect_stop = False
-        signal.signal(signal.SIGTERM, self.sigint)
-        signal.signal(signal.SIGINT, self.sigint)
-        self.lircConnection = lircConnection(self)
+        # switch transition waiting for the old frontend to exit
+        self.detach_waiting = None
+        # power key or shutdown timer, shutdown_pending once ShutdownPending
+        # has announced a shutdown that has not been withdrawn
+        self.timer = None
+        self.shutdown_pending = False
+        # (frontend name, state) last sent with FrontendChanged
+        self.last_state = ('', 0)
+        self.state_source = None
+        self.transitions = TransitionScheduler(
+            self.metrics,
+            self.settings.get_settingi('Frontend', 'transition_timeout', 30),
+            on_finish=lambda transition: self.state_changed())
+        self.remote = RemoteControl(self)
+        self.settings.watch(self.on_settings_changed)
+        # other instances' players may hold their own sound devices
+        self.sound_watcher = SoundDeviceWatcher(pids=self.player_pids)
         if self.dbus2vdr.checkVDRstatus():
             self.prepare()
+        self.metrics.observe('startup_imports', IMPORTED - STARTED)
+        self.metrics.observe('startup_bus_name',
+                             service.name_acquired - STARTED)
+        self.metrics.observe('startup_init', time.monotonic() - STARTED)
+
+    @property
+    def locations(self):
+        # dbus-python sends a signal from every location, the old path
+        # /frontend only takes method calls
+        return (location for location in super().locations
+                if location[1] == self.path)
 
     def prepare(self):
+        with self.metrics.timed('startup_dbus2vdr'):
+            self.connect_vdr()
         # init Frontends
-        self.dbus2vdr = DBus2VDR(dbus.SystemBus(), instance=0)
-        self.frontends = {}
-        self.frontends['vdr'] = self.get_vdrFrontend()
-        self.frontends['kodi'] = self.get_kodiFrontend()
-        for frontend, obj in self.frontends.items():
-            if not obj:
-                logging.warning("using dummy frontend")
-                self.frontends[frontend] = vdrFrontend(self, 'dummy')
-        self.switch = itertools.cycle(self.frontends.keys())
-        while not next(self.switch) == self.settings.frontend:
-            pass
-        logging.debug("set main frontend to {0}".format(
-            self.settings.frontend))
-        self.startup()
+        with self.metrics.timed('startup_frontends'):
+            self.frontends = {}
+            self.frontends['vdr'] = self.get_vdrFrontend()
+            self.frontends['kodi'] = self.get_kodiFrontend()
+            for frontend, obj in self.frontends.items():
+                if not obj:
+                    log.warning("using dummy frontend")
+                    self.frontends[frontend] = vdrFrontend(self, 'dummy')
+            self.switch = itertools.cycle(self.frontends.keys())
+            while not next(self.switch) == self.settings.frontend:
+                pass
+        log.debug("set main frontend to %s", self.settings.frontend)
+        with self.metrics.timed('startup_attach'):
+            self.startup()
 
     def restart(self):
         try:
             self.frontends['vdr'].detach()
         except:
             pass
-        self.frontends['vdr'] = self.get_vdrFrontend()
-        for frontend, obj in self.frontends.items():
-            if not obj:
-                logging.warning("using dummy frontend")
-                self.frontends[frontend] = vdrFrontend(self, 'dummy')
-        self.startup()
+        with self.metrics.timed('startup_dbus2vdr'):
+            self.connect_vdr()
+        with self.metrics.timed('startup_frontends'):
+            self.frontends['vdr'] = self.get_vdrFrontend()
+            for frontend, obj in self.frontends.items():
+                if not obj:
+                    log.warning("using dummy frontend")
+                    self.frontends[frontend] = vdrFrontend(self, 'dummy')
+        with self.metrics.timed('startup_attach'):
+            self.startup()
+
+    def connect_dbus2vdr(self, **kwargs):
+        return DBus2VDR(self.bus, instance=self.instance, **kwargs)
+
+    def get_vdr_owner(self):
+        try:
+            return self.bus.get_name_owner(self.dbus2vdr.vdr_obj)
+        except dbus.DBusException:
+            return None
+
+    def get_vdr_pid(self):
+        """return the pid of vdr's bus name owner"""
+        owner = self.get_vdr_owner()
+        if owner is None:
+            return None
+        if self.vdr_pid[0] != owner:
+            try:
+                pid = int(self.bus.call_blocking(
+                    'org.freedesktop.DBus', '/org/freedesktop/DBus',
+                    'org.freedesktop.DBus', 'GetConnectionUnixProcessID',
+                    's', (owner,)))
+            except dbus.DBusException as error:
+                log.warning("no pid of vdr's bus name owner: %s", error)
+                return None
+            self.vdr_pid = (owner, pid)
+        return self.vdr_pid[1]
+
+    def player_pids(self, vdr=True):
+        """return the pids of vdr and the players of this instance"""
+        pids = list(self.processes.processes)
+        if vdr:
+            pids.append(self.get_vdr_pid())
+        return [pid for pid in pids if pid is not None]
+
+    def connect_vdr(self):
+        """build a new DBus2VDR object only if vdr's bus name got a new
+        owner since the current one was built"""
+        owner = self.get_vdr_owner()
+        if owner != self.dbus2vdr_owner:
+            log.debug("vdr has a new bus name owner: %s", owner)
+            self.dbus2vdr = self.connect_dbus2vdr()
+            self.dbus2vdr_owner = owner
+            self.plugins = None
+
+    def get_plugins(self):
+        """return the names of vdr's plugins, the list is requested once
+        per vdr process"""
+        if self.plugins is None:
+            with self.metrics.timed('startup_plugins'):
+                try:
+                    plugins = self.bus.get_object(
+                        self.dbus2vdr.vdr_obj, '/Plugins').List(
+                            dbus_interface='de.tvdr.vdr.pluginmanager')
+                except dbus.DBusException as error:
+                    log.warning("could not get vdr plugins: %s", error)
+                    return set()
+            self.plugins = {str(name) for name, version in plugins}
+            log.debug("vdr plugins: %s", self.plugins)
+        return self.plugins
 
     def startup(self):
+        self.state_changed()
         self.wakeup = self.checkWakeup()
-        logging.debug("running startup()")
+        log.debug("running startup()")
         if self.settings.attach == 'never' or (self.settings.attach == 'auto'
                                                and not self.wakeup):
             self.current = self.settings.frontend
@@ -109,7 +307,7 @@ class Main(dbus.service.Object):
             self.frontends['kodi'].attach()
             self.current = 'kodi'
             self.dbus2vdr.Remote.Disable()
-            logging.debug('startup: frontend is kodi')
+            log.debug('startup: frontend is kodi')
         elif self.current == 'vdr' or (self.settings.frontend == 'vdr' and
                                        not self.current):
             # check if vdr is ready
@@ -117,9 +315,9 @@ class Main(dbus.service.Object):
                 self.vdrStatus = 1
                 self.frontends['vdr'].resume()
                 self.current = 'vdr'
-                logging.debug("startup: using vdr frontend %s", self.current)
+                log.debug("startup: using vdr frontend %s", self.current)
             else:
-                logging.debug("vdr not ready")
+                log.debug("vdr not ready")
                 self.vdrStatus = 0
                 return
 
@@ -132,16 +330,79 @@ class Main(dbus.service.Object):
         else:
             return True
 
+    def state_changed(self):
+        """called wherever the frontend state may have changed, the
+        signals are sent once the main loop is idle"""
+        if self.state_source is None:
+            self.state_source = GObject.idle_add(self.send_state)
+
+    def send_state(self):
+        self.state_source = None
+        frontends = getattr(self, 'frontends', {})
+        name = frontends[self.current].name if self.current in frontends \
+            else ''
+        state = (name, self.status() if frontends else 0)
+        if state != self.last_state:
+            self.last_state = state
+            log.debug("frontend changed: %s %s", *state)
+            self.metrics.inc('state_signals')
+            self.FrontendChanged(*state)
+        return False
+
+    @dbus.service.signal('de.yavdr.frontend', signature='si')
+    def FrontendChanged(self, name, state):
+        """the current frontend or its state (0=detached, 1=attached,
+        2=suspended, 3=external player) has changed"""
+        pass
+
+    @dbus.service.signal('de.yavdr.frontend')
+    def ExternalBegin(self):
+        """an external player has taken over the output"""
+        pass
+
+    @dbus.service.signal('de.yavdr.frontend')
+    def ExternalEnd(self):
+        """the external player has quit, the frontend is attached again"""
+        pass
+
+    @dbus.service.signal('de.yavdr.frontend', signature='i')
+    def ShutdownPending(self, delay):
+        """vdr is asked to shut down in delay seconds, -1 if a pending
+        shutdown has been cancelled"""
+        pass
+
+    @dbus.service.method('de.yavdr.frontend', out_signature='(si)')
+    def getState(self):
+        """return the state last sent with FrontendChanged, subscribe to
+        the signal instead of polling this"""
+        return self.last_state
+
     @dbus.service.method('de.yavdr.frontend', out_signature='i')
     def checkFrontend(self):
         """return status of current frontend"""
-        return self.status()
+        return self.get_status(refresh=True)
+
+    def run_transition(self, name, func, *args):
+        """queue a transition, return its result if it could run at once"""
+        transition = self.transitions.request(name, func, *args)
+        if transition.finished:
+            return bool(transition.result)
+        return True
+
+    @dbus.service.method('de.yavdr.frontend', out_signature='as')
+    def getTransitions(self):
+        """return the running and the queued transitions"""
+        return self.transitions.names()
 
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def toggleFrontend(self):
         """toggle between active and inactive frontend"""
-        if self.status() == 1:
-            self.detach()
+        return self.run_transition('toggle', self.do_toggle)
+
+    def do_toggle(self):
+        # the user may have detached or suspended it in vdr's menu
+        if self.get_status(refresh=True) == 1:
+            self.do_detach()
         else:
             self.frontends[self.current].resume()
         return True
@@ -149,26 +410,45 @@ class Main(dbus.service.Object):
     @dbus.service.method('de.yavdr.frontend', out_signature='s')
     def switchFrontend(self):
         """switch from vdr frontend to kodi and vice versa"""
-        if self.status() == 2:
-            self.resume()
+        self.run_transition('switch', self.do_switch)
+        return self.getFrontend()
+
+    def do_switch(self):
+        self.metrics.start('switch')
+        if self.get_status(refresh=True) == 2:
+            self.do_resume()
         if self.current == 'vdr':
             self.dbus2vdr.Remote.Disable()
         old = self.current
         self.current = next(self.switch)
-        logging.debug("next frontend is {0}".format(self.current))
+        log.debug("next frontend is %s", self.current)
         if self.frontends[old].status():
             self.frontends[old].detach()
-        if self.current == "kodi":
-            self.attach()
-        return self.getFrontend()
+            if self.frontends[old].detach_async:
+                # detach_complete() goes on once it has exited
+                self.detach_waiting = self.transitions.current
+                return PENDING
+        return self.completeFrontendSwitch()
 
-    @dbus.service.method('de.yavdr.frontend', out_signature='s')
-    def tempDisplay(self):
+    @dbus.service.method('de.yavdr.frontend', out_signature='s',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def tempDisplay(self, reply_handler, error_handler):
         """show currently used display"""
         self.setBackground(self.settings.get_setting('Frontend', 'bg_attached',
                                                      None))
-        self.settings.update_display(os.environ['DISPLAY'])
-        return os.environ['DISPLAY']
+        self.executor.submit(self.settings.get_display,
+                             self.env['DISPLAY'],
+                             callback=lambda display, error:
+                             self.on_tempdisplay(display, error,
+                                                 reply_handler, error_handler))
+
+    def on_tempdisplay(self, display, error, reply_handler, error_handler):
+        if error:
+            error_handler(error)
+            return
+        self.env['DISPLAY'] = display
+        log.debug("DISPLAY: %s", display)
+        reply_handler(display)
 
     @dbus.service.method('de.yavdr.frontend',
                          in_signature='s',
@@ -176,17 +456,33 @@ class Main(dbus.service.Object):
     def setDisplay(self, display=None):
         """set DISPLAY varible for internal use"""
         if display:
-            os.env['DISPLAY'] = display
+            self.env['DISPLAY'] = display
             return True
         else:
             return False
 
     @dbus.service.method('de.yavdr.frontend', out_signature='s')
     def getDisplay(self):
-        return os.env['DISPLAY']
+        return self.env['DISPLAY']
 
-    def completeFrontendSwitch(self):
-        self.attach()
+    def detach_complete(self):
+        """called by a frontend with detach_async once it has exited"""
+        transition, self.detach_waiting = self.detach_waiting, None
+        if transition is not None and transition.active:
+            self.completeFrontendSwitch(transition)
+        else:
+            # the switch has timed out or was cancelled meanwhile, nothing
+            # is attached now
+            log.debug("late exit of the old frontend")
+            self.run_transition('complete', self.completeFrontendSwitch)
+
+    def completeFrontendSwitch(self, transition=None):
+        """attach the frontend switched to, transition is the switch (by
+        default the running transition) finished once it is ready"""
+        if transition is None:
+            transition = self.transitions.current
+        result = self.do_attach(
+            on_ready=lambda ready: self.on_switch_ready(ready, transition))
         if self.current == 'vdr':
             self.dbus2vdr.Remote.Enable()
         if self.wants_shutdown and self.frontends[self.current
@@ -194,9 +490,19 @@ class Main(dbus.service.Object):
             self.send_shutdown()
             self.wants_shutdown = False
             self.dbus2vdr.Remote.Enable()
-        logging.debug("frontend after switch: %s", self.current)
+        log.debug("frontend after switch: %s", self.current)
+        if result is PENDING:
+            return PENDING
+        self.on_switch_ready(True, transition)
         return self.getFrontend()
 
+    def on_switch_ready(self, ready, transition):
+        if transition is None or not transition.active:
+            log.debug("ignoring late readiness of %s", self.current)
+            return
+        self.metrics.stop('switch')
+        transition.done()
+
     @dbus.service.method('de.yavdr.frontend', out_signature='s')
     def getFrontend(self):
         """return current frontend"""
@@ -207,21 +513,42 @@ class Main(dbus.service.Object):
     @dbus.service.method('de.yavdr.frontend', in_signature='s',
                          out_signature='b')
     def attach(self, options=None):
-        try:
-            GObject.source_remove(self.timer)
-        except:
-            pass
+        return self.run_transition('attach', self.do_attach, options)
+
+    def do_attach(self, options=None, on_ready=None):
+        """attach the current frontend. Returns PENDING if its picture is
+        not on screen yet, on_ready(ready) is called once it is (by
+        default the attach transition is finished then)."""
+        self.cancel_timer()
+        result = None
+        frontend = None
+        if not self.external and self.current:
+            frontend = self.frontends[self.current]
+            with self.metrics.timed('attach'):
+                result = frontend.attach(options)
+        # the background is changed while the player starts up
         self.setBackground(self.settings.get_setting('Frontend', 'bg_attached',
                                                      None))
-        if not self.external:
-            if self.current:
-                return self.frontends[self.current].attach(options)
-                return True
+        if on_ready is None:
+            transition = self.transitions.current
+            on_ready = lambda ready: self.on_attach_ready(ready, transition)
+        if result and frontend is not None and frontend.when_ready(on_ready):
+            return PENDING
+        return result
+
+    def on_attach_ready(self, ready, transition):
+        if transition is not None and transition.active:
+            transition.done(ready)
 
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def detach(self, set_bg=True, expect_stop=True):
+        return self.run_transition('detach', self.do_detach, set_bg,
+                                   expect_stop)
+
+    def do_detach(self, set_bg=True, expect_stop=True):
         self.expect_stop = expect_stop
-        answer = self.frontends[self.current].detach()
+        with self.metrics.timed('detach'):
+            answer = self.frontends[self.current].detach()
         if set_bg:
             self.setBackground(self.settings.get_setting('Frontend',
                                                          'bg_detached', None))
@@ -229,60 +556,131 @@ class Main(dbus.service.Object):
 
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def resume(self):
+        return self.run_transition('resume', self.do_resume)
+
+    def do_resume(self):
         if not self.external:
-            status = self.frontends[self.current].resume()
+            with self.metrics.timed('resume'):
+                status = self.frontends[self.current].resume()
             self.dbus2vdr.Remote.Enable()
             self.setBackground()
             return status
 
     @dbus.service.method('de.yavdr.frontend', out_signature='i')
     def status(self):
+        return self.get_status()
+
+    def get_status(self, refresh=False):
+        """return the state of the current frontend, with refresh=True
+        it is asked instead of answering from the status cache"""
         if not self.external and self.current:
-            return self.frontends[self.current].status()
+            return self.frontends[self.current].status(refresh)
         elif not self.current:
             return 0
         else:
             return 3
 
-    @dbus.service.method('de.yavdr.frontend', out_signature='b')
-    def begin_external(self):
+    @dbus.service.method('de.yavdr.frontend', out_signature='a{sa{sd}}')
+    def getMetrics(self):
+        """return latency histograms and counters"""
+        return self.metrics.snapshot()
+
+    @dbus.service.method('de.yavdr.frontend', in_signature='ss',
+                         out_signature='b')
+    def setLogLevel(self, logger, level):
+        """set the level of a module's logger (e.g. 'tools.remote'), an
+        empty name sets the root logger; until the settings are reloaded"""
+        self.service.settings.log_manager.set_level(str(logger), str(level))
+        return True
+
+    @dbus.service.method('de.yavdr.frontend', out_signature='a{ss}')
+    def getLogLevels(self):
+        """return the loggers that have a level of their own"""
+        return self.service.settings.log_manager.get_levels()
+
+    @dbus.service.method('de.yavdr.frontend', out_signature='a{s(siias)}')
+    def getSupervisors(self):
+        """return state, crashes in a row, restarts within restart_window
+        and the last exits of the player processes"""
+        return {frontend.name: frontend.supervisor.status()
+                for frontend in getattr(self, 'frontends', {}).values()
+                if frontend.supervisor is not None}
+
+    @dbus.service.method('de.yavdr.frontend', out_signature='a{s(sid)}')
+    def getProcesses(self):
+        """return state (starting, running, exiting), pid and uptime of
+        the player processes"""
+        return self.processes.status()
+
+    @dbus.service.method('de.yavdr.frontend', in_signature='sa{ss}',
+                         out_signature='b')
+    def setProcessOptions(self, name, options):
+        """change cpu_affinity, nice, ioprio or sched_rr of the player
+        of frontend name ('vdr', 'kodi' or the backend's name) until the
+        settings are reloaded, returns True if a running player was
+        changed"""
+        frontends = getattr(self, 'frontends', {})
+        frontend = frontends.get(name) or next(
+            (f for f in frontends.values() if f.name == name), None)
+        if frontend is None or frontend.launcher is None:
+            raise ValueError("{0} does not run a player".format(name))
+        for option, value in options.items():
+            frontend.launcher.set_option(str(option), str(value))
+        pid = frontend.get_pid()
+        if pid is None:
+            return False
+        frontend.launcher.apply(pid)
+        return True
+
+    @dbus.service.method('de.yavdr.frontend', out_signature='b',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def begin_external(self, reply_handler, error_handler):
         self.external = True
+        self.ExternalBegin()
+        self.state_changed()
+        # transitions queued before the external player took over are void
+        self.transitions.cancel_all()
         self.detach(set_bg=False)
-        snd_free = False
-        while not snd_free:
-            logging.debug("check if frontend has freed sound device")
-            fuser_pid = subprocess.Popen(['fuser', '-v',
-                                          '/dev/snd/*p'],
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE, shell=True)
-            fuser_pid.wait()
-            stdout, stderr = fuser_pid.communicate()
-            logging.debug("fuser output: %s", stderr)
-            if ("kodi") in str(stderr) or str(stderr).endswith("vdr"):
-                snd_free = False
-                time.sleep(0.25)
-            else:
-                snd_free = True
-                logging.debug('kodi has freed sound device')
+        log.debug("check if frontend has freed sound device")
+        self.sound_watcher.wait(self.on_external_sound_free, reply_handler)
 
-        return True
+    def on_external_sound_free(self, free, reply_handler):
+        log.debug('frontend has freed sound device: %s', free)
+        reply_handler(True)
 
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def end_external(self):
         self.external = False
+        self.ExternalEnd()
+        self.state_changed()
         self.attach()
         return True
 
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def soft_detach(self):
-        logging.debug("running soft_detach")
+        log.debug("running soft_detach")
         if self.settings.get_setting('Frontend', 'attach', 'always'
                                      ) in ['auto', 'always']:
             self.detach()
-            logging.debug("add timer for send_shutdown")
+            log.debug("add timer for send_shutdown")
         self.timer = GObject.timeout_add(300000, self.send_shutdown)
+        self.shutdown_pending = True
+        self.ShutdownPending(300)
         return False
 
+    def cancel_timer(self):
+        """remove the power key or shutdown timer, a pending shutdown is
+        withdrawn with ShutdownPending(-1)"""
+        if self.timer is not None:
+            try:
+                GObject.source_remove(self.timer)
+            except Exception:
+                log.debug("could not remove timer")
+            self.timer = None
+        if self.shutdown_pending:
+            self.shutdown_pending = False
+            self.ShutdownPending(-1)
+
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def init_shutdown(self):
         if self.current == 'xmbc':
@@ -291,140 +689,229 @@ class Main(dbus.service.Object):
 
     @dbus.service.method('de.yavdr.frontend', out_signature='b')
     def send_shutdown(self, user=False):
-        disable_remote = False
-        if (self.dbus2vdr.Shutdown.ConfirmShutdown(user)
-                and self.check_lifeguard()):
-            logging.debug("send 'HitKey POWER' to vdr")
-            if not self.dbus2vdr.Remote.Status():
-                self.dbus2vdr.Remote.Enable()
-                disable_remote = True
-            self.dbus2vdr.Remote.HitKey("POWER")
-            if disable_remote:
-                self.dbus2vdr.Remote.Disable()
+        if self.dbus2vdr.Shutdown.ConfirmShutdown(user):
+            self.check_lifeguard(self.on_lifeguard)
         else:
-            logging.debug("send_shutdown: VDR not ready to shut down")
+            log.debug("send_shutdown: VDR not ready to shut down")
         return True
 
+    def on_lifeguard(self, ready):
+        if not ready:
+            log.debug("send_shutdown: lifeguard-ng vetoed shutdown")
+            return
+        disable_remote = False
+        self.shutdown_pending = False
+        self.ShutdownPending(0)
+        log.debug("send 'HitKey POWER' to vdr")
+        if not self.dbus2vdr.Remote.Status():
+            self.dbus2vdr.Remote.Enable()
+            disable_remote = True
+        self.dbus2vdr.Remote.HitKey("POWER")
+        if disable_remote:
+            self.dbus2vdr.Remote.Disable()
+
     @dbus.service.method('de.yavdr.frontend', in_signature='ss',
                          out_signature='b')
     def setBackground(self, path=None, display=None):
         status = self.status()
-        old_display = None
+        env = dict(self.env)
         if display:
-            old_display = os.environ['DISPLAY']
-            os.environ['DISPLAY'] = display
-        logging.debug("setBackground: status is %s, type is %s" %
-                      (status, type(status)))
+            env['DISPLAY'] = display
+        log.debug("setBackground: status is %s, type is %s", status,
+                  type(status))
         if status == 0 and not path:
                 path = self.settings.get_setting('Frontend', 'bg_detached',
                                                  None)
         elif status == 1 and not path:
                 path = self.settings.get_setting('Frontend', 'bg_attached',
                                                  None)
-        logging.debug("Background path is %s" % path)
+        log.debug("Background path is %s", path)
         if path:
             command = ["/usr/bin/feh", "--bg-fill", path]
-            logging.debug("command for setting bg is: %s" % (
-                " ".join(command)))
-            subprocess.call(command, env=os.environ)
-        if old_display:
-            os.environ['DISPLAY'] = old_display
+            if not (self.settings.get_setting('Frontend', 'bg_renderer',
+                                              'auto') == 'auto' and
+                    self.background.set_background(
+                        path, env['DISPLAY'],
+                        lambda: self.run_feh(command, env))):
+                log.debug("command for setting bg is: %s", command)
+                self.run_feh(command, env)
         return True
 
+    def preload_backgrounds(self):
+        if self.settings.get_setting('Frontend', 'bg_renderer',
+                                     'auto') != 'auto':
+            return
+        paths = [self.settings.get_setting('Frontend', name, None)
+                 for name in ('bg_attached', 'bg_detached')]
+        self.background.preload([path for path in paths if path],
+                                self.env['DISPLAY'])
+
+    def run_feh(self, command, env):
+        if self.bg_proc is not None:
+            # only the last background requested while feh runs matters
+            self.bg_pending = (command, env)
+            return
+        try:
+            self.bg_proc = self.executor.spawn(command, self.on_feh_exit,
+                                               env=env)
+        except OSError as error:
+            log.warning("could not run feh: %s", error)
+
+    def on_feh_exit(self, returncode):
+        self.bg_proc = None
+        if returncode:
+            log.debug("feh exited with %s", returncode)
+        if self.bg_pending:
+            command, env = self.bg_pending
+            self.bg_pending = None
+            self.run_feh(command, env)
+
     def inhibit(self, what='sleep:shutdown', who='First Base',
-                why="left field", mode="block"):
+                why="left field", mode="block", callback=None):
+        """request a logind inhibitor lock, callback(fd) receives it"""
+        def on_error(error):
+            log.warning("could not set inhibitor lock: %s", error)
         try:
             a = self.bus.get_object('org.freedesktop.login1',
                                     '/org/freedesktop/login1')
             interface = 'org.freedesktop.login1.Manager'
-            fd = a.Inhibit(what, who, why, mode, dbus_interface=interface)
-            return fd
+            a.Inhibit(what, who, why, mode, dbus_interface=interface,
+                      reply_handler=callback or (lambda fd: None),
+                      error_handler=on_error)
         except Exception as error:
-            logging.exception(error)
-            logging.warning("could not set inhibitor lock")
+            log.exception(error)
+            log.warning("could not set inhibitor lock")
+
+    def check_lifeguard(self, callback):
+        """callback(ready) receives False if lifeguard-ng vetoes a shutdown,
+        True if it agrees or can't be reached"""
+        def on_reply(status, text):
+            if not status:
+                log.debug("lifeguard-ng is not ready to shutdown: %s",
+                          text)
+            callback(bool(status))
 
-    def check_lifeguard(self):
+        def on_error(error):
+            log.debug("could not reach lifeguard-ng: %s", error)
+            callback(True)
         try:
             if_lifeguard = "org.yavdr.lifeguard"
             lifeguard = self.bus.get_object('org.yavdr.lifeguard',
                                             "/Lifeguard")
-            status, text = lifeguard.Check(dbus_interface=if_lifeguard)
-            if not status:
-                logging.debug("lifeguard-ng is not ready to shutdown")
-                return False
+            lifeguard.Check(dbus_interface=if_lifeguard,
+                            reply_handler=on_reply, error_handler=on_error)
         except Exception as error:
-            logging.exception(error)
-            logging.debug("could not reach lifeguard-ng")
-        finally:
-            return True
+            log.exception(error)
+            on_error(error)
 
     def get_vdrFrontend(self):
-        if self.dbus2vdr.Plugins.check_plugin('softhddevice'):
-            frontend = Softhddevice(self, 'softhddevice')
-        elif self.dbus2vdr.Plugins.check_plugin('xineliboutput'):
-            frontend = VDRsxfe(self, 'vdr-sxfe')
-        elif self.dbus2vdr.Plugins.check_plugin('xine'):
-            frontend = Xine(self, 'xine')
+        plugins = self.get_plugins()
+        if 'softhddevice' in plugins:
+            frontend = get_backend('softhddevice')(self, 'softhddevice')
+        elif 'xineliboutput' in plugins:
+            frontend = get_backend('xineliboutput')(self, 'vdr-sxfe')
+        elif 'xine' in plugins:
+            frontend = get_backend('xine')(self, 'xine')
         else:
-            logging.warning("no vdr frontend found")
-            frontend = None
-        logging.debug("primary frontend is {0}".format(frontend.name))
+            log.warning("no vdr frontend found")
+            return None
+        log.debug("primary frontend is %s", frontend.name)
         return frontend
 
     def get_kodiFrontend(self):
         if self.settings.kodi and not self.current == 'kodi':
-            return KODI(self)
+            return get_backend('kodi')(self)
         elif self.current == 'kodi':
             return self.frontends[self.current]
         else:
-            logging.warning("no KODI configuration found")
+            log.warning("no KODI configuration found")
             return None
 
+    @dbus.service.method('de.yavdr.frontend', out_signature='as')
+    def reloadConfig(self):
+        """read the config file again, return the changed settings"""
+        return ["{0}.{1}".format(*key)
+                for key in sorted(self.settings.reload())]
+
+    def on_settings_changed(self, changed):
+        sections = {section for section, key in changed}
+        if 'Frontend' in sections:
+            self.remote.settings_changed(changed)
+        if sections & {'Frontend'}:
+            self.background.cache_size = self.settings.get_settingi(
+                'Frontend', 'bg_cache_size', 4)
+            self.preload_backgrounds()
+        if ('Frontend', 'DISPLAY') in changed:
+            self.executor.submit(
+                self.settings.get_display,
+                self.settings.get_setting('Frontend', 'DISPLAY', ":0"),
+                callback=self.on_display_changed)
+        for frontend in getattr(self, 'frontends', {}).values():
+            frontend.settings_changed(changed)
+
+    def on_display_changed(self, display, error):
+        if error:
+            log.error("could not update DISPLAY: %s", error)
+            return
+        self.env['DISPLAY'] = display
+        log.debug("instance %s: DISPLAY is %s", self.instance, display)
+
+    def invalidate_status(self):
+        for frontend in getattr(self, 'frontends', {}).values():
+            frontend.invalidate_status()
+
     def onStart(self, *args, **kwargs):
         print("VDR Ready")
-        if self.current == 'kodi':
-            self.restart()
-        else:
-            self.prepare()
+        self.invalidate_status()
+        with self.metrics.timed('vdr_ready'):
+            if self.current == 'kodi':
+                self.restart()
+            else:
+                self.prepare()
         self.vdrStatus == 1
 
     def onStop(self, *args, **kwargs):
         print("VDR stopped")
-        logging.debug("vdr stopping")
+        log.debug("vdr stopping")
+        self.invalidate_status()
         if self.current == 'vdr':
             self.current = None
         self.vdrStatus == 0
+        self.state_changed()
 
     def dbus2vdr_signal(self, *args, **kwargs):
-        logging.debug("got signal %s", kwargs['member'])
-        logging.debug(args)
+        log.debug("got signal %s", kwargs['member'])
+        log.debug(args)
         if kwargs['member'] == "Ready":
-            logging.debug("vdr ready")
+            log.debug("vdr ready")
             if self.current == 'kodi':
                 self.restart()
             else:
                 self.prepare()
         elif kwargs['member'] == "Stop":
-            logging.debug("vdr stopping")
+            log.debug("vdr stopping")
             if self.current == 'vdr':
                 self.current = None
         elif kwargs['member'] == "Start":
-            logging.debug("vdr starting")
+            log.debug("vdr starting")
 
     def vdrDBusSignal(self):
         self.bus.watch_name_owner(self.dbus2vdr.vdr_obj,
                                   self.name_owner_changed)
 
     def name_owner_changed(self, *args, **kwargs):
+        self.invalidate_status()
+        self.plugins = None
         if len(args[0]) == 0:
-            logging.debug("vdr has no dbus name ownership")
+            log.debug("vdr has no dbus name ownership")
             if self.current == 'vdr':
                 self.current = None
+                self.state_changed()
             if self.vdrStatus != 0:
                 self.onStop()
         else:
-            logging.debug("vdr has dbus name ownership")
-        logging.debug(args)
+            log.debug("vdr has dbus name ownership")
+        log.debug(args)
 
     def set_toggle(self, target):
         while not next(self.switch) == self.target:
@@ -432,57 +919,102 @@ class Main(dbus.service.Object):
 
     @dbus.service.method('de.yavdr.frontend')
     def quit(self):
-        logging.info("quit frontend script")
-        self.frontends[self.current].detach()
-        self.loop.quit()
-        sys.exit()
+        self.service.quit()
 
-    def sigint(self, signal, *args, **kwargs):
-        logging.info("got %s" % signal)
-        self.frontends[self.current].detach()
-        time.sleep(1)
-        self.loop.quit()
-        sys.exit()
+    def shutdown(self):
+        frontends = getattr(self, 'frontends', {})
+        if self.current in frontends:
+            frontends[self.current].detach()
+        for frontend in frontends.values():
+            frontend.cleanup()
+        self.remote.close()
+        if self.state_source is not None:
+            GObject.source_remove(self.state_source)
+            self.state_source = None
+
+
+def to_bool(value):
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError("Not a boolean: {0}".format(value))
+
+
+class SettingsSnapshot:
+    """immutable view of the config file, converted values are cached"""
+    __slots__ = ('values', 'cache')
+    converters = {'s': str, 'b': to_bool, 'i': int, 'f': float}
+
+    def __init__(self, parser):
+        values = {(section, key): value for section in parser.sections()
+                  for key, value in parser.items(section)}
+        object.__setattr__(self, 'values', values)
+        object.__setattr__(self, 'cache', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("settings snapshot is read-only")
+
+    def get(self, kind, category, setting, default, instance=0):
+        """a value in the section 'category:instance' overrides the one
+        in 'category'"""
+        key = (kind, category, setting, default, instance)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        value = self.values.get(('{0}:{1}'.format(category, instance),
+                                 setting))
+        if value is None:
+            value = self.values.get((category, setting))
+        if value is None:
+            value = default
+        else:
+            value = self.converters[kind](value)
+        self.cache[key] = value
+        return value
+
+    def changed(self, other):
+        """return the (section, key) pairs that differ from other"""
+        return {key for key in self.values.keys() | other.values.keys()
+                if self.values.get(key) != other.values.get(key)}
 
 
 class Settings:
     def __init__(self, config):
         self.config = config
+        self.listeners = []
+        self.monitor = None
+        self.reload_timer = None
         self.init_parser()
 
     def get_setting(self, category, setting, default):
-        return self.parser[category].get(setting, default)
+        return self.snapshot.get('s', category, setting, default)
 
     def get_settingb(self, category, setting, default):
-        return self.parser[category].getboolean(setting, default)
+        return self.snapshot.get('b', category, setting, default)
 
     def get_settingi(self, category, setting, default):
-        return self.parser[category].getint(setting, default)
+        return self.snapshot.get('i', category, setting, default)
 
     def get_settingf(self, category, setting, default):
-        return self.parser[category].getfloat(setting, default)
+        return self.snapshot.get('f', category, setting, default)
 
-    def init_parser(self, config=None):
-        self.parser = configparser.ConfigParser(delimiters=(":", "="),
-                                                    interpolation=None
-                                                    )
-        self.parser.optionxform = str
+    def read_snapshot(self):
+        parser = configparser.ConfigParser(delimiters=(":", "="),
+                                           interpolation=None
+                                           )
+        parser.optionxform = str
         with open(self.config, 'r', encoding='utf-8') as f:
-            self.parser.read_file(f)
-        self.log2file = self.get_settingb('Logging', 'use_file', False)
-        self.logfile = self.get_setting('Logging', 'logfile',
-                                        "/tmp/frontend.log")
-        self.loglevel = self.get_setting('Logging', 'loglevel', "DEBUG")
-        line_format = '%(asctime)-15s %(levelname)-6s %(message)s'
-        if self.log2file:
-            logging.basicConfig(filename=self.logfile,
-                                level=getattr(logging, self.loglevel),
-                                format=line_format
-                                )
-        else:
-            logging.basicConfig(level=getattr(logging, self.loglevel),
-                                format=line_format
-                                )
+            parser.read_file(f)
+        return SettingsSnapshot(parser)
+
+    def init_parser(self, config=None):
+        self.snapshot = self.read_snapshot()
+        self.log_manager = LogManager()
+        self.log_manager.configure(self)
+        self.load_settings()
+
+    def load_settings(self):
         # frontend settings: primary: vdr|kodi
         self.frontend = self.get_setting('Frontend', 'frontend', "vdr")
         self.kodi = self.get_setting('KODI', 'kodi', None)
@@ -491,23 +1023,122 @@ class Settings:
         get_tempdisplay = self.get_setting('Frontend', 'get_tempdisplay',
                                            'dbget vdr.tempdisplay')
         self.get_tempdisplay = shlex.split(get_tempdisplay)
-        display = self.get_setting('Frontend', 'DISPLAY', ":0")
-        logging.debug(display)
-        self.update_display(display)
+        # vdr instances served by this process
+        instances = self.get_setting('Frontend', 'instances', "0")
+        self.instances = [int(i) for i in instances.replace(',', ' ').split()]
+
+    def watch(self, callback):
+        """call callback(changed) with the changed (section, key) pairs
+        after the config file has been reloaded"""
+        self.listeners.append(callback)
+        if self.monitor is None:
+            self.monitor = Gio.File.new_for_path(self.config).monitor_file(
+                Gio.FileMonitorFlags.NONE, None)
+            self.monitor.connect('changed', self.on_file_changed)
+
+    def on_file_changed(self, monitor, file, other_file, event):
+        if event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                     Gio.FileMonitorEvent.CREATED):
+            # editors write files in several steps, wait for the last one
+            if self.reload_timer is not None:
+                GObject.source_remove(self.reload_timer)
+            self.reload_timer = GObject.timeout_add(200, self.on_reload_timer)
 
-    def update_display(self, display):
+    def on_reload_timer(self):
+        self.reload_timer = None
+        self.reload()
+        return False
+
+    def reload(self):
+        """read the config file again and return the changed keys"""
+        try:
+            snapshot = self.read_snapshot()
+        except (OSError, configparser.Error) as error:
+            log.error("keeping old settings, could not read %s: %s",
+                      self.config, error)
+            return set()
+        changed = snapshot.changed(self.snapshot)
+        if not changed:
+            return changed
+        log.info("settings changed: %s", sorted(changed))
+        self.snapshot = snapshot
+        self.load_settings()
+        if any(section == 'Logging' for section, key in changed):
+            self.log_manager.configure(self)
+        for callback in self.listeners:
+            try:
+                callback(changed)
+            except Exception as error:
+                log.exception(error)
+        return changed
+
+    def get_display(self, display):
+        """return display with the screen set by get_tempdisplay, this
+        runs an external command and should be called from a worker"""
         try:
             tempdisplay = subprocess.check_output(self.get_tempdisplay
                                                   ).decode()
         except:
             tempdisplay = ""
         if len(tempdisplay) > 0:
-            logging.debug("got:", display.split(".")[0], tempdisplay)
-            os.environ['DISPLAY'] = display.split(".")[0] + tempdisplay
-            logging.debug("DISPLAY is", os.environ['DISPLAY'])
+            log.debug("got: %s %s", display.split(".")[0], tempdisplay)
+            return display.split(".")[0] + tempdisplay
         else:
-            os.environ['DISPLAY'] = display.split(".")[0]
-        logging.debug("DISPLAY: %s", os.environ['DISPLAY'])
+            return display.split(".")[0]
+
+
+class InstanceSettings(Settings):
+    """settings of a single vdr instance, keys in a section named
+    'Section:<instance>' override those in 'Section'"""
+    def __init__(self, settings, instance):
+        self.parent = settings
+        self.instance = instance
+        self.config = settings.config
+        self.load_settings()
+
+    @property
+    def snapshot(self):
+        return self.parent.snapshot
+
+    def get_setting(self, category, setting, default):
+        return self.snapshot.get('s', category, setting, default,
+                                 self.instance)
+
+    def get_settingb(self, category, setting, default):
+        return self.snapshot.get('b', category, setting, default,
+                                 self.instance)
+
+    def get_settingi(self, category, setting, default):
+        return self.snapshot.get('i', category, setting, default,
+                                 self.instance)
+
+    def get_settingf(self, category, setting, default):
+        return self.snapshot.get('f', category, setting, default,
+                                 self.instance)
+
+    def local_changes(self, changed):
+        """return the changed keys that affect this instance, named by
+        their base section"""
+        suffix = ':{0}'.format(self.instance)
+        local = set()
+        for section, key in changed:
+            if ':' not in section:
+                local.add((section, key))
+            elif section.endswith(suffix):
+                local.add((section[:-len(suffix)], key))
+        return local
+
+    def watch(self, callback):
+        self.parent.watch(lambda changed: self.on_reload(changed, callback))
+
+    def on_reload(self, changed, callback):
+        changed = self.local_changes(changed)
+        if changed:
+            self.load_settings()
+            callback(changed)
+
+    def reload(self):
+        return self.local_changes(self.parent.reload())
 
 
 class Options():
@@ -517,6 +1148,10 @@ class Options():
                                dest="config",
                                default='/etc/conf.d/frontend.conf',
                                metavar="CONFIG_FILE")
+        self.parser.add_option("--profile-startup",
+                               dest="profile_startup",
+                               action="store_true", default=False,
+                               help="report import and init times")
 
     def get_options(self):
         (options, args) = self.parser.parse_args()
@@ -524,10 +1159,9 @@ class Options():
 
 
 if __name__ == '__main__':
-    DBusGMainLoop(set_as_default=True)
     options = Options()
     global main
-    main = Main(options.get_options())
+    main = FrontendService(options.get_options())
     main.loop = GObject.MainLoop()
     try:
         main.loop.run()
@@ -3,19 +3,20 @@
 #from dbus.mainloop.glib import DBusGMainLoop
 #dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 import logging
-from frontends.base import vdrFrontend
-import os
+from frontends.base import SVDRPProbe, vdrFrontend
+log = logging.getLogger(__name__)
 
 
 class Softhddevice(vdrFrontend):
     def __init__(self, main, dbus2vdr, name="softhddevice"):
+        self.probe = SVDRPProbe(self)
         super().__init__(main, dbus2vdr)
 
     def get_options(self):
         options = self.main.settings.get_setting('Softhddevice',
                                                       'options',
                                                       '-d {DISPLAY}')
-        return options.format(DISPLAY=os.environ['DISPLAY'])
+        return options.format(DISPLAY=self.main.env['DISPLAY'])
 
     def attach(self, options=None):
         try:
@@ -25,40 +26,40 @@ class Softhddevice(vdrFrontend):
                 user_active = False
             if not options:
                 options = self.get_options()
-            code, result = self.main.dbus2vdr.Plugins.SVDRPCommand(
-                "softhddevice", "atta", options)
-            if code == 900 and self.status() == 1:
-                logging.debug("softhddevice successfully attached")
-                self.state = 1
+            code, result = self.svdrp("softhddevice", "atta", options)
+            if code == 900:
+                log.debug("softhddevice successfully attached")
+                self.set_status(1)
+                self.start_probe()
                 if (not user_active and self.main.settings.get_settingb(
                         'Softhddevice', 'keep_inactive', False)):
                     self.main.dbus2vdr.Shutdown.SetUserInactive()
                 return True
             else:
-                logging.debug(
-                    "failed to attach softhddevice: {0}: {1}".format(code,
-                                                                     result)
-                )
+                log.debug("failed to attach softhddevice: %s: %s", code,
+                          result)
+                self.invalidate_status()
                 return False
         except Exception as error:
-            logging.exception(error)
+            log.exception(error)
+            self.invalidate_status()
             return False
 
     def detach(self):
+        self.probe.abort()
         try:
-            code, result = self.main.dbus2vdr.Plugins.SVDRPCommand(
-                "softhddevice",
-                "deta")
-            if code == 900 and self.status() == 0:
-                logging.debug("softhddevice successfully detached")
-                self.state = 0
+            code, result = self.svdrp("softhddevice", "deta")
+            if code == 900:
+                log.debug("softhddevice successfully detached")
+                self.set_status(0)
                 return True
             else:
-                logging.debug("failed to detach softhddevice")
+                log.debug("failed to detach softhddevice")
+                self.invalidate_status()
                 return False
-            return False
         except Exception as error:
-            logging.exception(error)
+            log.exception(error)
+            self.invalidate_status()
             return False
 
     def resume(self):
@@ -67,27 +68,26 @@ class Softhddevice(vdrFrontend):
             self.state = 1
         elif state == 2:
             try:
-                code, result = self.main.dbus2vdr.Plugins.SVDRPCommand(
-                    "softhddevice",
-                    "resu")
-                if code == 900 and self.status() == 1:
-                    self.state = 1
-                    logging.debug("resumed softhddevice successfully")
+                code, result = self.svdrp("softhddevice", "resu")
+                if code == 900:
+                    self.set_status(1)
+                    log.debug("resumed softhddevice successfully")
                 else:
-                    logging.debug("failed to resume softhddevice")
+                    log.debug("failed to resume softhddevice")
+                    self.invalidate_status()
             except Exception as error:
-                logging.exception(error)
+                log.exception(error)
+                self.invalidate_status()
         elif state == 0:
             self.attach()
 
-    def status(self):
-        code, result = self.main.dbus2vdr.Plugins.SVDRPCommand("softhddevice",
-                                                               "stat")
+    def query_status(self):
+        code, result = self.svdrp("softhddevice", "stat")
         if code == 910:
             state = 1
         elif code == 911:
             state = 2
-        elif code == 912:
+        else:
             state = 0
-        logging.debug("softhddevice: got status code: %s" % code)
+        log.debug("softhddevice: got status code: %s", code)
         return state
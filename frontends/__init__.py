@@ -1 +1,30 @@
 #/usr/bin/python3
+import importlib
+import logging
+import sys
+import time
+log = logging.getLogger(__name__)
+
+# backend name -> (module, class); a module is imported when its backend is
+# used for the first time
+BACKENDS = {
+    'softhddevice': ('frontends.Softhddevice', 'Softhddevice'),
+    'xineliboutput': ('frontends.xineliboutput', 'VDRsxfe'),
+    'xine': ('frontends.xine', 'Xine'),
+    'kodi': ('frontends.kodi', 'KODI'),
+}
+
+# module -> seconds it took to import
+import_times = {}
+
+
+def get_backend(name):
+    """return the frontend class registered as name"""
+    module_name, class_name = BACKENDS[name]
+    if module_name not in sys.modules:
+        start = time.monotonic()
+        importlib.import_module(module_name)
+        import_times[module_name] = time.monotonic() - start
+        log.debug("imported %s in %.3f s", module_name,
+                  import_times[module_name])
+    return getattr(sys.modules[module_name], class_name)
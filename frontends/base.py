@@ -1,23 +1,326 @@
 #!/usr/bin/python3
+from gi.repository import GObject
+import logging
+import time
+try:
+    from Xlib import X
+    import Xlib.display
+    import Xlib.error
+except ImportError:
+    Xlib = None
+log = logging.getLogger(__name__)
+
+
+class ReadinessProbe:
+    """tell when the picture of a frontend is on screen. check() runs on
+    start and on every retry until the probe is done or ready_timeout of
+    the frontend has passed, callbacks get ready=True or False."""
+    def __init__(self, frontend, interval=0.05, max_interval=0.5):
+        self.frontend = frontend
+        self.interval = interval
+        self.max_interval = max_interval
+        self.started = None
+        self.waiters = []
+        self.timer = None
+        self.deadline = None
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def start(self, callback=None):
+        self.cancel()
+        self.started = time.monotonic()
+        self.waiters = [callback] if callback else []
+        self.delay = self.interval
+        self.deadline = GObject.timeout_add(
+            int(self.frontend.ready_timeout * 1000), self.done, False)
+        self.check()
+
+    def wait(self, callback):
+        self.waiters.append(callback)
+
+    def check(self):
+        self.done(True)
+
+    def retry(self):
+        if self.running and self.timer is None:
+            self.timer = GObject.timeout_add(int(self.delay * 1000),
+                                             self.on_timer)
+            self.delay = min(self.delay * 2, self.max_interval)
+
+    def on_timer(self):
+        self.timer = None
+        self.check()
+        return False
+
+    def done(self, ready):
+        if not self.running:
+            return False
+        duration = time.monotonic() - self.started
+        if ready:
+            log.debug("%s: picture after %.3f s", self.frontend.name,
+                      duration)
+            self.frontend.main.metrics.observe(
+                'first_frame_{0}'.format(self.frontend.name), duration)
+        else:
+            log.warning("%s: no picture within %s s", self.frontend.name,
+                        self.frontend.ready_timeout)
+            self.frontend.main.metrics.inc('probe_timeouts')
+        self.finish(ready)
+        return False
+
+    def abort(self):
+        """stop waiting because the frontend is going away"""
+        if self.running:
+            self.finish(False)
+
+    def finish(self, ready):
+        waiters = self.waiters
+        self.cancel()
+        for callback in waiters:
+            callback(ready)
+
+    def cancel(self):
+        for source in (self.timer, self.deadline):
+            if source is not None:
+                GObject.source_remove(source)
+        self.timer = self.deadline = None
+        self.started = None
+        self.waiters = []
+        self.close()
+
+    def close(self):
+        """release what check() has opened"""
+        pass
+
+
+class SVDRPProbe(ReadinessProbe):
+    """ready once the plugin's stat command reports the frontend as
+    attached. The answers go into the frontend's status cache."""
+    def check(self):
+        try:
+            state = self.frontend.status(refresh=True)
+        except Exception as error:
+            log.debug("%s: stat failed: %s", self.frontend.name, error)
+            state = None
+        if state == 1:
+            self.done(True)
+        else:
+            self.retry()
+
+
+class JSONRPCProbe(ReadinessProbe):
+    """ready once KODI answers JSONRPC.Ping"""
+    def __init__(self, frontend, rpc):
+        super().__init__(frontend)
+        self.rpc = rpc
+
+    def check(self):
+        try:
+            self.rpc.call_async('JSONRPC.Ping', callback=self.on_pong)
+        except OSError:
+            # not listening yet
+            self.retry()
+
+    def on_pong(self, result, error):
+        if not self.running:
+            return
+        if result == 'pong':
+            self.done(True)
+        else:
+            self.retry()
+
+
+class X11WindowProbe(ReadinessProbe):
+    """ready once a window of the player process or with one of the
+    WM_CLASS names is mapped. Map events of the root window's children
+    trigger a check, so there is no need to poll fast."""
+    def __init__(self, frontend, names=()):
+        super().__init__(frontend, interval=0.25, max_interval=1.0)
+        self.names = set(names)
+        self.display = None
+        self.watch = None
+
+    def connect(self):
+        self.display = Xlib.display.Display(self.frontend.main.env['DISPLAY'])
+        self.pid_atom = self.display.intern_atom('_NET_WM_PID')
+        self.root = self.display.screen().root
+        self.root.change_attributes(event_mask=X.SubstructureNotifyMask)
+        self.display.flush()
+        self.watch = GObject.io_add_watch(self.display.fileno(),
+                                          GObject.IO_IN, self.on_events)
+
+    def check(self):
+        if Xlib is None:
+            log.debug("python-xlib is missing, can't check %s's window",
+                      self.frontend.name)
+            # nothing to measure, don't hold up the attach
+            self.finish(True)
+            return
+        try:
+            if self.display is None:
+                self.connect()
+            found = self.find_window()
+        except (Xlib.error.DisplayError, Xlib.error.XError,
+                ConnectionError) as error:
+            log.warning("can't check %s's window: %s", self.frontend.name,
+                        error)
+            self.finish(True)
+            return
+        if found:
+            self.done(True)
+        else:
+            self.retry()
+
+    def on_events(self, fd, condition):
+        mapped = False
+        while self.display.pending_events():
+            if self.display.next_event().type == X.MapNotify:
+                mapped = True
+        if mapped:
+            self.check()
+        return self.watch is not None
+
+    def find_window(self):
+        process = getattr(self.frontend, 'process', None)
+        pid = process.pid if process is not None else None
+        # window managers put the player's window into a frame
+        for top in self.root.query_tree().children:
+            for window in [top] + list(top.query_tree().children):
+                try:
+                    if window.get_attributes().map_state != X.IsViewable:
+                        continue
+                    prop = window.get_full_property(self.pid_atom,
+                                                    X.AnyPropertyType)
+                    if prop and pid in prop.value:
+                        return True
+                    wm_class = window.get_wm_class() or ()
+                    if self.names.intersection(wm_class):
+                        return True
+                except Xlib.error.BadWindow:
+                    # gone while we looked at it
+                    continue
+        return False
+
+    def close(self):
+        if self.watch is not None:
+            GObject.source_remove(self.watch)
+            self.watch = None
+        if self.display is not None:
+            self.display.close()
+            self.display = None
 
 
 class vdrFrontend:
+    # config sections load_settings() depends on
+    sections = ('Frontend',)
+    # True if detach() returns before the frontend has exited, the
+    # frontend then calls main.detach_complete() itself
+    detach_async = False
+    # RestartSupervisor and Launcher of frontends that run a player process
+    supervisor = None
+    launcher = None
+    # ReadinessProbe telling when the picture is on screen after attach
+    probe = None
+
     def __init__(self, main, name):
         self.main = main
         self.name = name
         self.state = 0  # 0=detached, 1=active, 2=suspended
+        self.load_settings()
+        self.status_ts = None
+        self.status_hits = 0  # status queries answered from cache
+        self.status_queries = 0  # status queries sent to the backend
+
+    def load_settings(self):
+        # cached status is trusted for status_ttl seconds
+        self.status_ttl = self.main.settings.get_settingf('Frontend',
+                                                          'status_ttl', 1.0)
+        if self.supervisor is not None:
+            self.supervisor.configure(self.main.settings)
+        # give up waiting for the picture after ready_timeout seconds
+        self.ready_timeout = self.main.settings.get_settingf(
+            'Frontend', 'ready_timeout', 10.0)
+
+    def settings_changed(self, changed):
+        """called with the changed (section, key) pairs after a reload"""
+        if any(section in self.sections for section, key in changed):
+            log.debug("%s: reloading settings", self.name)
+            self.load_settings()
+            pid = self.get_pid()
+            if pid is not None:
+                self.launcher.apply(pid)
+
+    def get_pid(self):
+        """return the pid of the running player process or None"""
+        process = getattr(self, 'process', None)
+        if self.launcher is None or process is None or not process.running:
+            return None
+        return process.pid
+
+    def start_probe(self):
+        """start waiting for the picture, call when attach begins"""
+        if self.probe is not None:
+            self.probe.start(self.on_ready)
+
+    def on_ready(self, ready):
+        process = getattr(self, 'process', None)
+        if ready and process is not None:
+            process.ready()
+        self.main.state_changed()
+
+    def when_ready(self, callback):
+        """call callback(ready) once the picture is on screen, return
+        False if there is nothing to wait for"""
+        if self.probe is None or not self.probe.running:
+            return False
+        self.probe.wait(callback)
+        return True
 
     def attach(self, options=None):
-        self.state = 1
+        self.set_status(1)
 
     def detach(self):
-        self.state = 0
+        self.set_status(0)
+
+    def status(self, refresh=False):
+        """return the cached state, ask the backend if it is stale or
+        refresh is True"""
+        if (not refresh and self.status_ts is not None and
+                time.monotonic() - self.status_ts < self.status_ttl):
+            self.status_hits += 1
+            self.main.metrics.inc('status_cache_hits')
+            return self.state
+        self.status_queries += 1
+        self.main.metrics.inc('status_queries')
+        log.debug("%s: query status (%d queries, %d avoided)",
+                  self.name, self.status_queries, self.status_hits)
+        return self.set_status(self.query_status())
 
-    def status(self):
+    def query_status(self):
         return self.state
 
+    def set_status(self, state):
+        self.state = state
+        self.status_ts = time.monotonic()
+        return state
+
+    def svdrp(self, plugin, command, *args):
+        """send a SVDRP command to a plugin and record its latency"""
+        with self.main.metrics.timed('svdrp'):
+            return self.main.dbus2vdr.Plugins.SVDRPCommand(plugin, command,
+                                                           *args)
+
+    def cleanup(self):
+        """release resources held in the background before exiting"""
+        pass
+
+    def invalidate_status(self):
+        self.status_ts = None
+
     def resume(self):
         if self.state == 2:
-            self.state = 1
+            self.set_status(1)
         elif self.state == 0:
-            self.state = 1
+            self.set_status(1)
@@ -3,22 +3,40 @@
 #from dbus.mainloop.glib import DBusGMainLoop
 #dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 from gi.repository import GObject
-import json
 import logging
 import os
-import shlex
-import socket
-import subprocess
-import time
+import signal
+from frontends.base import JSONRPCProbe, vdrFrontend
+from tools.jsonrpc import JSONRPCClient
+from tools.launcher import Launcher
+from tools.sound import SoundDeviceWatcher
+from tools.supervisor import RestartSupervisor
+log = logging.getLogger(__name__)
 
 
-class KODI():
+class KODI(vdrFrontend):
+    sections = ('Frontend', 'KODI')
+    detach_async = True
+
     def __init__(self, main):
-        self.main = main
-        self.name = 'kodi'
-        os.environ['__GL_SYNC_TO_VBLANK'] = "1"
-        # TODO Display config:
-        os.environ['__GL_SYNC_DISPLAY_DEVICE'] = os.environ['DISPLAY']
+        self.supervisor = RestartSupervisor('kodi', main.metrics)
+        self.launcher = Launcher('kodi')
+        super().__init__(main, 'kodi')
+        self.main.env['__GL_SYNC_TO_VBLANK'] = "1"
+        self.main.env['__GL_SYNC_DISPLAY_DEVICE'] = self.main.env['DISPLAY']
+        self.process = None
+        # kodi of this instance only, vdr has been detached
+        self.sound_watcher = SoundDeviceWatcher(
+            pids=lambda: self.main.player_pids(vdr=False))
+        self.rpc = JSONRPCClient(
+            'localhost', self.main.settings.get_settingi('KODI', 'rpc_port',
+                                                         9090))
+        self.rpc.on_notification('System.OnQuit', self.on_quit)
+        self.probe = JSONRPCProbe(self, self.rpc)
+        self.stopping = False
+
+    def load_settings(self):
+        super().load_settings()
         cmd = self.main.settings.get_setting(
             'KODI', 'kodi',
             '/usr/lib/kodi/kodi.bin --standalone --lircdev /var/run/lirc/lircd'
@@ -26,186 +44,180 @@ class KODI():
         self.shutdown_inhibitor = self.main.settings.get_setting(
             'KODI', 'shutdown_inhibitor', False)
         ae_sink = self.main.settings.get_setting('KODI', 'AE_SINK', "ALSA")
-        os.environ['AE_SINK'] = ae_sink
-        self.cmd = shlex.split(cmd)
-        self.proc = None
-        self.block = False
-        logging.debug('kodi command: %s', self.cmd)
-
-    def send_tcp_command(self, cmd):
-        host = 'localhost'
-        port = 9090
-        buffer_size = 1024
-        message = json.dumps(cmd).encode()
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((host, port))
-            s.send(message)
-            data = s.recv(buffer_size)
-            return data
+        self.main.env['AE_SINK'] = ae_sink
+        self.launcher.configure(self.main.settings, 'KODI', cmd)
+        # detach asks kodi to quit, sends SIGTERM if it is still running
+        # after quit_timeout s and SIGKILL after another stop_timeout s
+        self.quit_timeout = self.main.settings.get_settingf(
+            'KODI', 'quit_timeout', 5.0)
+        self.stop_timeout = self.main.settings.get_settingf(
+            'KODI', 'stop_timeout', 5.0)
+        # kodi may take a while to load its skin and library
+        self.ready_timeout = self.main.settings.get_settingf(
+            'KODI', 'ready_timeout', 20.0)
 
     def quit_kodi(self):
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "Application.Quit",
-            "params": [],
-            "description": "Quit application",
-            "returns": {
-                "type": "string"
-            }
-        }
+        """ask kodi to quit without waiting for the answer, return False
+        if the request could not be sent"""
         try:
-            response = json.loads(self.send_tcp_command(payload).decode())
-        except Exception as e:
-            logging.exception(e)
-            logging.error('could not connect to KODI')
+            self.rpc.call_async("Application.Quit",
+                                callback=self.on_quit_reply)
+        except OSError as error:
+            log.warning('could not connect to KODI: %s', error)
             return False
-        if response['params']['data']['exitcode'] == 0:
-            return True
+        return True
+
+    def on_quit_reply(self, result, error):
+        if error is not None and self.process is not None:
+            log.warning('KODI refused to quit: %s', error)
+            self.process.stop(self.stop_timeout)
+
+    def on_quit(self, params):
+        # kodi has started to quit, on_exit() follows once it is gone
+        log.debug('kodi is quitting')
+        self.main.metrics.stop('kodi_quit')
 
     def attach(self, options=None):
-        logging.info('starting kodi')
+        log.info('starting kodi')
+        self.supervisor.cancel()
         self.main.expect_stop = False
         if self.status() == 1:
             return
         if self.shutdown_inhibitor:
             try:
                 # Shutdown inhibitor
-                self.inhibitor = self.main.inhibit(
+                self.main.inhibit(
                     what="shutdown:sleep:idle",
                     who="frontend",
                     why="kodi running",
-                    mode="block"
+                    mode="block",
+                    callback=self.set_inhibitor
                 )
             except:
-                logging.warning("could not set shutdown-inhobitor")
+                log.warning("could not set shutdown-inhobitor")
         try:
-            self.proc = subprocess.Popen(self.cmd, env=os.environ)
-            if self.proc:
-                self.block = True
-            if self.proc.poll() is not None:
-                logging.warning("failed to start kodi")
-                self.main.switchFrontend()
-            # Add callback on exit
-            GObject.child_watch_add(self.proc.pid, self.on_exit, self.proc)
-            logging.debug('started kodi')
-        except:
-            logging.exception('could not start kodi')
+            with self.main.metrics.timed('kodi_spawn'):
+                # on_exit also handles a kodi that fails to start
+                self.process = self.main.processes.spawn(
+                    self.launcher, self.main.env, self.on_exit, ready=False)
+            self.supervisor.started()
+            self.start_probe()
+            log.debug('started kodi')
+        except OSError:
+            log.exception('could not start kodi')
             return False
         return True
 
-    def kill_kodi(self):
-        logging.debug("trying to kill kodi")
-        try:
-            self.proc.kill()
-            return False
-        except:
-            logging.exception("could not kill kodi")
-
-    def on_exit(self, pid, condition, data):
-        logging.debug("called function with pid=%s, condition=%s, data=%s",
-                      pid, condition, data)
-        snd_free = False
-        while not snd_free:
-            logging.debug("check if kodi has freed sound device")
-            fuser_pid = subprocess.Popen(['fuser', '-v',
-                                          '/dev/snd/*p'],
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE, shell=True)
-            fuser_pid.wait()
-            stdout, stderr = fuser_pid.communicate()
-            if "kodi" in str(stderr):
-                snd_free = False
-                time.sleep(0.25)
-            else:
-                snd_free = True
-                logging.debug('kodi has freed sound device')
-        self.block = False
+    def cleanup(self):
+        self.supervisor.cancel()
+        self.probe.cancel()
+
+    def set_inhibitor(self, fd):
+        self.inhibitor = fd
+
+    def on_exit(self, pid, condition, process):
+        log.debug("called function with pid=%s, condition=%s", pid,
+                  condition)
+        if process is not self.process:
+            return
+        self.probe.abort()
+        self.main.metrics.cancel('kodi_quit')
+        self.rpc.close("kodi exited")
+        log.debug("kodi exited: %s", self.supervisor.exited(pid, condition))
+        log.debug("check if kodi has freed sound device")
+        self.sound_watcher.wait(self.on_sound_free, condition)
+
+    def on_sound_free(self, free, condition):
+        log.debug('kodi has freed sound device: %s', free)
+        self.main.metrics.stop('kodi_exit')
+        self.process = None
+        self.main.state_changed()
+        stopping, self.stopping = self.stopping, False
         if not self.main.external:
-            if condition == 0:
-                logging.info("normal kodi exit")
+            if condition == 0 or stopping:
+                # a kodi killed by detach() is no crash either
+                log.info("normal kodi exit")
                 if self.main.current == 'kodi':
-                    logging.debug("normal KODI exit")
+                    log.debug("normal KODI exit")
                     if not self.main.external and not self.main.expect_stop:
+                        # the switch attaches vdr, kodi is gone already
                         self.main.switchFrontend()
-                        self.main.completeFrontendSwitch()
                 else:
-                    logging.debug("call completeFrontendSwitch")
-                    self.main.completeFrontendSwitch()
+                    log.debug("complete the switch to %s",
+                              self.main.current)
+                    self.main.detach_complete()
             elif condition < 16384:
-                logging.warn("abnormal exit: %s", condition)
-                if (self.main.current == "kodi" and
-                        self.main.settings.frontend == "kodi"):
-                    logging.debug("resume kodi after crash")
-                    self.main.frontends[self.main.current].resume()
-                elif self.main.current == "kodi":
-                    logging.debug("switch frontend after crash")
-                    self.main.switchFrontend()
-                else:
-                    logging.debug("complete switch to other frontend")
-                    self.main.completeFrontendSwitch()
+                log.warning("abnormal exit: %s", condition)
+                self.on_crash()
             elif condition == 16384:
-                logging.info("KODI want's a shutdown")
+                log.info("KODI want's a shutdown")
                 self.main.switchFrontend()
                 #TODO: Remote handling
                 self.main.wants_shutdown = True
                 self.main.dbus2vdr.Remote.HitKey("Power")
             elif condition == 16896:
-                logging.info("KODI wants a reboot")
-                #logging.info(self.main.powermanager.restart())
+                log.info("KODI wants a reboot")
+                #log.info(self.main.powermanager.restart())
                 # TODO: Reboot implementation via logind?
             else:
-                logging.warn("abnormal exit: %s", condition)
-                if (self.main.current == "kodi" and
-                        self.main.settings.frontend == "kodi"):
-                    logging.debug("resume kodi after crash")
-                    self.main.frontends[self.main.current].resume()
-                elif self.main.current == "kodi":
-                    logging.debug("switch frontend after crash")
-                    self.main.switchFrontend()
-                else:
-                    logging.debug("complete switch to other frontend")
-                    self.main.completeFrontendSwitch()
-                self.main.switchFrontend()
+                log.warning("abnormal exit: %s", condition)
+                self.on_crash()
         try:
             os.close(self.inhibitor.take())
         except:
             pass
-        try:
-            GObject.source_remove(self.killtimer)
-        except:
-            pass
-        self.kiltimer = None
 
-    def detach(self, active=0):
-        logging.info('stopping kodi')
-        try:
-            self.killtimer = GObject.timeout_add(10000, self.kill_kodi)
-            #self.proc.terminate()
-            if self.quit_kodi():
-                self.proc.wait()
-                GObject.source_remove(self.killtimer)
-        except:
-            logging.info('kodi already terminated')
+    def on_crash(self):
+        if (self.main.current == "kodi" and
+                self.main.settings.frontend == "kodi"):
+            log.debug("resume kodi after crash")
+            if not self.supervisor.restart(self.resume_after_crash):
+                # kodi keeps crashing, fall back to vdr
+                self.main.switchFrontend()
+        elif self.main.current == "kodi":
+            log.debug("switch frontend after crash")
+            self.main.switchFrontend()
+        else:
+            log.debug("complete switch to other frontend")
+            self.main.detach_complete()
 
-    def status(self):
-        try:
-            logging.debug("kodi status is %s, self.block is %s" %
-                          (self.proc.poll(), self.block))
-        except:
-            logging.debug("kodi not running, self.block is %s", self.block)
-        if self.proc is None:
-            return 0
-        elif not self.block:
-            return 0
-        elif self.block:
-            logging.debug("self.block is True: kodi is running")
-            return 1
+    def resume_after_crash(self):
+        # queued, a switch or an external player may be on the way
+        self.main.run_transition('restart', self.restart_after_crash)
+
+    def restart_after_crash(self):
+        if self.main.current == "kodi" and not self.main.external:
+            return self.resume()
+        return True
+
+    def detach(self, active=0):
+        log.info('stopping kodi')
+        self.supervisor.cancel()
+        self.probe.abort()
+        if self.process is None or not self.process.alive:
+            log.info('kodi already terminated')
+            return
+        self.stopping = True
+        self.main.metrics.start('kodi_exit')
+        self.main.metrics.start('kodi_quit')
+        # nothing here waits for kodi: on_exit() completes the detach once
+        # it is gone, SIGTERM and SIGKILL follow if it takes too long
+        if self.quit_kodi():
+            self.process.stop(self.quit_timeout, signum=None, escalation=(
+                (signal.SIGTERM, self.stop_timeout),
+                (signal.SIGKILL, None)))
         else:
-            logging.debug("self.block is False: kodi is not running")
+            self.process.stop(self.stop_timeout)
+
+    def status(self, refresh=False):
+        # kodi holds the display and sound device until it is reaped
+        if self.process is None or not self.process.alive:
             return 0
+        log.debug("kodi is %s", self.process.state)
+        return 1
 
     def resume(self):
-        if self.proc and self.proc.poll() is None:
-            logging.debug("kodi already running")
+        if self.status() == 1:
+            log.debug("kodi already running")
         else:
             self.attach()
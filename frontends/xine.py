@@ -1,17 +1,25 @@
 #!/usr/bin/python3
-import dbus
-from dbus.mainloop.glib import DBusGMainLoop
-dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-from gi.repository import GObject
 import logging
 from frontends.base import *
-import os
-import subprocess
+from tools.launcher import Launcher
+from tools.supervisor import RestartSupervisor
+log = logging.getLogger(__name__)
+
+class Xine(vdrFrontend):
+    sections = ('Frontend', 'Xine', 'xine')
 
-class Xine():
     def __init__(self, main, name):
-        self.main = main
-        self.name = name
+        self.supervisor = RestartSupervisor(name, main.metrics)
+        self.launcher = Launcher(name)
+        self.probe = X11WindowProbe(self, names=('xine',))
+        self.stopping = False
+        super().__init__(main, name)
+        self.main.env['__GL_SYNC_TO_VBLANK'] = "1"
+        self.main.env['__GL_SYNC_DISPLAY_DEVICE'] = self.main.env['DISPLAY']
+        self.process = None
+
+    def load_settings(self):
+        super().load_settings()
         if self.main.settings.get_settingb('Xine', 'autocrop', False):
             autocrop = "--post autocrop:enable_autodetect=1,enable_subs_detect=1,soft_start=1,stabilize=1"
         else:
@@ -22,11 +30,7 @@ class Xine():
             )
         else:
             aspectratio = ""
-        os.environ['__GL_SYNC_TI_VBLANK']="1"
-        # TODO Display config:
-        os.environ['__GL_SYNC_DISPLAY_DEVICE'] = os.environ['DISPLAY']
-
-        self.cmd = self.main.settings.get_setting("Xine",
+        cmd = self.main.settings.get_setting("Xine",
                                                   "xine_cmd",
             '''/usr/bin/xine --post tvtime:method=use_vo_driver \
             --config /etc/xine/config \
@@ -37,41 +41,61 @@ class Xine():
             {autocrop} {aspectratio} \
             vdr:/tmp/vdr-xine/stream#demux:mpeg_pes'''.format(autocrop=autocrop, aspectratio=aspectratio)
             )
-        self.proc = None
-        self.environ = os.environ
+        self.launcher.configure(self.main.settings, 'Xine', cmd)
+        self.stop_timeout = self.main.settings.get_settingf(
+            'Xine', 'stop_timeout', 5.0)
 
     def attach(self, options=None):
-        logging.debug('starting xine')
-        logging.debug('self.cmd')
-        self.proc = subprocess.Popen("exec " + self.cmd,
-                                     shell=True, env=os.environ)
-        GObject.child_watch_add(self.proc.pid,self.on_exit,self.proc) # Add callback on exit
-        logging.debug('started xine')
+        self.supervisor.cancel()
+        if self.process is not None and self.process.running:
+            return True
+        log.debug('starting xine')
+        self.stopping = False
+        try:
+            self.process = self.main.processes.spawn(
+                self.launcher, self.main.env, self.on_exit, ready=False)
+        except OSError:
+            log.exception('could not start xine')
+            return False
+        self.supervisor.started()
+        self.start_probe()
+        log.debug('started xine')
+        return True
 
     def detach(self, active=0):
-        logging.debug('stopping xine')
-        try:
-            self.proc.kill()
-            return True
-        except Exception as e:
-            logging.exception(e)
-            logging.debug('xine already terminated')
-        self.proc = None
+        log.debug('stopping xine')
+        self.stopping = True
+        self.supervisor.cancel()
+        self.probe.abort()
+        if self.process is None:
+            log.debug('xine already terminated')
+            return
+        self.process.stop(self.stop_timeout)
+        return True
 
-    def status(self):
-        if self.proc: return 1
+    def status(self, refresh=False):
+        if self.process is not None and self.process.running: return 1
         else: return 0
 
     def resume(self):
-        if self.proc: pass
+        if self.status(): pass
         else: self.attach()
 
-    def on_exit(self,pid, condition, data):
-        logging.debug("called function with pid=%s, condition=%s, data=%s",pid, condition,data)
-        self.proc = None
-        logging.debug("xine exit code was:", condition)
-        if condition == 0:
-            self.proc = None
+    def on_exit(self, pid, condition, process):
+        log.debug("called function with pid=%s, condition=%s", pid, condition)
+        if process is not self.process:
+            # stopped before a new xine was started
+            return
+        self.probe.abort()
+        self.process = None
+        self.main.state_changed()
+        reason = self.supervisor.exited(pid, condition)
+        log.debug("xine exited: %s", reason)
+        if condition == 0 or self.stopping:
             return
         else:
-            self.main.attach()
+            self.supervisor.restart(self.main.attach)
+
+    def cleanup(self):
+        self.supervisor.cancel()
+        self.probe.cancel()
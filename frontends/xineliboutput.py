@@ -1,86 +1,107 @@
 #!/usr/bin/python3
-from gi.repository import GObject
 import logging
-from frontends.base import vdrFrontend
-import os
-import socket
-import subprocess
-import time
+from frontends.base import X11WindowProbe, vdrFrontend
+from tools.launcher import Launcher
+from tools.probe import PortProbe
+from tools.supervisor import RestartSupervisor
+log = logging.getLogger(__name__)
 
 
 class VDRsxfe(vdrFrontend):
+    sections = ('Frontend', 'Xineliboutput')
+
     def __init__(self, main, dbus2vdr, path='/usr/bin/vdr-sxfe',
                  origin='127.0.0.1',
                  port='37890'):
+        self.origin = origin
+        self.port = port
+        self.server_probe = PortProbe(origin, port)
+        self.supervisor = RestartSupervisor('vdr-sxfe', main.metrics)
+        self.launcher = Launcher('vdr-sxfe')
+        self.probe = X11WindowProbe(self, names=('vdr-sxfe', 'sxfe'))
+        self.stopping = False
         super().__init__(main, dbus2vdr)
         self.main = main
-        self.origin = origin
         self.name = "xineliboutput"
-        self.port = port
+        self.main.env['__GL_SYNC_TO_VBLANK'] = "1"
+        self.main.env['__GL_SYNC_DISPLAY_DEVICE'] = self.main.env['DISPLAY']
+        self.process = None
+        self.state = 0
+
+    def load_settings(self):
+        super().load_settings()
         self.mode = self.main.settings.get_setting('Xineliboutput',
                                                    'xineliboutput',
                                                    'remote')
-        self.main.settings.get_settingb('Xineliboutput', 'autocrop', False)
-        os.environ['__GL_SYNC_TO_VBLANK'] = "1"
-        os.environ['__GL_SYNC_DISPLAY_DEVICE'] = os.environ['DISPLAY']
-        self.cmd = self.main.settings.get_setting(
+        cmd = self.main.settings.get_setting(
             "Xineliboutput",
             "xineliboutput_cmd",
             '''/usr/bin/vdr-sxfe --post tvtime:method=use_vo_driver \
             --audio=alsa \
-            --syslog xvdr+tcp://{0}:{1}'''.format(origin, port)
+            --syslog xvdr+tcp://{0}:{1}'''.format(self.origin, self.port)
         )
-        self.proc = None
-        self.block = False
-        logging.debug('vdr-sxfe command: %s', self.cmd)
-        self.state = 0
+        self.server_probe.timeout = self.main.settings.get_settingf(
+            'Xineliboutput', 'attach_timeout', 30.0)
+        self.launcher.configure(self.main.settings, 'Xineliboutput', cmd)
+        self.stop_timeout = self.main.settings.get_settingf(
+            'Xineliboutput', 'stop_timeout', 5.0)
 
     def attach(self, options=None):
         if self.mode == 'remote' and self.status() == 0:
-            while not self.isOpen():
-                time.sleep(1)
-            logging.info('starting vdr-sxfe')
-            self.proc = subprocess.Popen("exec " + self.cmd, shell=True,
-                                         env=os.environ)
-            GObject.child_watch_add(self.proc.pid, self.on_exit,
-                                    self.proc)  # Add callback on exit
-            if self.proc:
-                self.block = True
-                logging.debug('started vdr-sxfe')
-            if self.proc.poll() is not None:
-                logging.warning("failed to start vdr-sxfe")
-                return False
-            else:
-                logging.debug('vdr-sxfe is still running')
-                self.state = 1
-                return True
+            self.supervisor.cancel()
+            if not self.server_probe.running:
+                log.debug('waiting for xineliboutput server')
+                # the wait for the server counts towards the first frame
+                self.start_probe()
+                self.server_probe.start(self.on_server_ready)
+            return True
         elif self.mode == 'local' and self.status() == 0:
-            self.main.dbus2vdr.Plugins.SVDRPCommand('xinelibputput', 'LFRO',
-                                                    'sxfe')
+            self.svdrp('xineliboutput', 'LFRO', 'sxfe')
             self.state = 1
             return True
 
+    def on_server_ready(self, ready):
+        if not ready:
+            log.warning("xineliboutput server did not come up, "
+                        "vdr-sxfe not started")
+            self.probe.abort()
+            return
+        log.info('starting vdr-sxfe')
+        self.stopping = False
+        try:
+            self.process = self.main.processes.spawn(
+                self.launcher, self.main.env, self.on_exit, ready=False)
+        except OSError:
+            log.exception('could not start vdr-sxfe')
+            self.probe.abort()
+            return
+        self.supervisor.started()
+        log.debug('started vdr-sxfe')
+        self.state = 1
+
     def detach(self, active=0):
         if self.mode == 'remote':
-            logging.info('stopping vdr-sxfe')
-            try:
-                self.proc.kill()
-                self.proc.wait()
-                return True
-            except:
-                logging.info('vdr-sxfe already terminated')
-            finally:
-                self.proc = None
+            log.info('stopping vdr-sxfe')
+            self.stopping = True
+            self.server_probe.cancel()
+            self.supervisor.cancel()
+            self.probe.abort()
+            if self.process is None:
+                log.info('vdr-sxfe already terminated')
+                return
+            # on_exit() reaps it without blocking the main loop
+            self.process.stop(self.stop_timeout)
+            self.state = 0
+            return True
             #self.main.dbus2vdr.Remote.Disable()
         elif self.mode == 'local':
-            self.main.dbus2vdr.Plugins.SVDRPCommand('xinelibputput', 'LFRO',
-                                                    'none')
+            self.svdrp('xineliboutput', 'LFRO', 'none')
             self.state = 0
             return True
 
-    def status(self):
+    def status(self, refresh=False):
         if self.mode == 'remote':
-            if self.proc:
+            if self.process is not None and self.process.running:
                 return 1
             else:
                 return 0
@@ -89,7 +110,7 @@ class VDRsxfe(vdrFrontend):
 
     def resume(self):
         if self.mode == 'remote':
-            if self.proc:
+            if self.status():
                 pass
             else:
                 self.attach()
@@ -97,22 +118,26 @@ class VDRsxfe(vdrFrontend):
             if self.state == 0:
                 self.attach()
 
-    def on_exit(self, pid, condition, data):
-        logging.debug("called function with pid=%s, condition=%s, data=%s",
-                      pid, condition, data)
+    def on_exit(self, pid, condition, process):
+        log.debug("called function with pid=%s, condition=%s", pid,
+                  condition)
+        if process is not self.process:
+            # a new vdr-sxfe was started before this one was gone
+            return
+        self.probe.abort()
+        self.process = None
         self.state = 0
-        logging.debug("vdr-sxfe exit code was: %s", condition)
-        if condition == 0:
+        self.main.state_changed()
+        log.debug("vdr-sxfe exited: %s",
+                  self.supervisor.exited(pid, condition))
+        if self.stopping:
+            pass
+        elif condition == 0:
             self.main.detach()
-            self.proc = None
         else:
-            self.main.attach()
+            self.supervisor.restart(self.main.attach)
 
-    def isOpen(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            s.connect((self.origin, int(self.port)))
-            s.shutdown(2)
-            return True
-        except:
-            return False
+    def cleanup(self):
+        self.server_probe.cancel()
+        self.probe.cancel()
+        self.supervisor.cancel()
@@ -3,5 +3,12 @@ setup(name='arch-frontend',
       version='0.0.1',
       py_modules=['frontend', 'frontends.base', 'frontends.Softhddevice',
                   'frontends.kodi', 'frontends.xineliboutput', 'frontends.xine',
-                  'tools.lirc_socket']
+                  'tools.lirc_socket', 'tools.sound', 'tools.probe',
+                  'tools.jsonrpc', 'tools.metrics',
+                  'tools.executor',
+                  'tools.background', 'tools.remote',
+                  'tools.evdev_input', 'tools.transitions',
+                  'tools.supervisor', 'tools.simulate',
+                  'tools.launcher', 'tools.logger',
+                  'tools.processes']
       )
@@ -0,0 +1,49 @@
+'''
+    Split the player commands of the shipped configuration into argv.
+'''
+
+import configparser
+import os
+
+import pytest
+
+from tools.launcher import split_command
+
+CONFIG = os.path.join(os.path.dirname(__file__), '..', 'etc', 'conf.d',
+                      'frontend.conf')
+
+
+@pytest.fixture
+def config():
+    # read like Settings.read_snapshot() does
+    parser = configparser.ConfigParser(delimiters=(":", "="),
+                                       interpolation=None)
+    parser.optionxform = str
+    with open(CONFIG, 'r', encoding='utf-8') as f:
+        parser.read_file(f)
+    return parser
+
+
+@pytest.mark.parametrize('section, option', [
+    ('Xine', 'xine'),
+    ('Xineliboutput', 'xineliboutput_cmd'),
+    ('KODI', 'kodi'),
+])
+def test_shipped_commands_have_no_line_breaks(config, section, option):
+    argv = split_command(config.get(section, option))
+    assert all('\n' not in arg and '\\' not in arg and arg for arg in argv)
+
+
+def test_continuation_lines_are_joined(config):
+    argv = split_command(config.get('Xineliboutput', 'xineliboutput_cmd'))
+    assert argv == [
+        '/usr/bin/vdr-sxfe', '-f', '-V', 'vdpau', '-A', 'alsa',
+        '--post', 'tvtime:method=use_vo_driver',
+        '--reconnect', '--syslog', '--silent', '--tcp',
+        '--config=/etc/vdr-sxfe/config_xineliboutput',
+        'xvdr://127.0.0.1:37890']
+
+
+def test_quotes_are_kept_together():
+    assert split_command('player --title "a b" \\\n    file') == [
+        'player', '--title', 'a b', 'file']
@@ -0,0 +1,181 @@
+'''
+    Replay recorded key streams through the remote control code.
+
+    The streams use the "<timestamp> <key> press|repeat|release" format
+    printed by tools/evdev_input.py. lircd doesn't send release events,
+    streams recorded from it only have presses and repeats.
+'''
+
+import pytest
+
+pytest.importorskip('gi')
+
+import time  # noqa: E402
+
+from tools import lirc_socket, remote  # noqa: E402
+from tools.metrics import Metrics  # noqa: E402
+from tools.remote import KeyDebouncer, RemoteControl, replay  # noqa: E402
+
+POWER = 'KEY_POWER2'
+
+
+def run(stream, **kwargs):
+    kwargs.setdefault('long_keys', (POWER,))
+    debouncer = KeyDebouncer(**kwargs)
+    return [(round(ts, 3), kind, key)
+            for ts, kind, key in replay(stream.splitlines(), debouncer)]
+
+
+def repeats(key, start, end, step=0.11):
+    """return stream lines of key held from start to end"""
+    lines = ["{0:.3f} {1} press".format(start, key)]
+    ts = start + step
+    while ts <= end + 1e-9:
+        lines.append("{0:.3f} {1} repeat".format(ts, key))
+        ts += step
+    return "\n".join(lines)
+
+
+def test_bounces_within_debounce_are_dropped():
+    stream = """
+        # a worn out button: the second press is a bounce
+        0.000 KEY_OK press
+        0.000 KEY_OK release
+        0.080 KEY_OK press
+        0.090 KEY_OK release
+        0.500 KEY_OK press
+        0.520 KEY_OK release
+    """
+    assert run(stream, debounce=0.3) == [(0.0, 'short', 'KEY_OK'),
+                                         (0.5, 'short', 'KEY_OK')]
+
+
+def test_debounce_is_per_key():
+    stream = """
+        0.000 KEY_PROG1 press
+        0.050 KEY_PROG2 press
+    """
+    assert run(stream, debounce=0.3) == [(0.0, 'short', 'KEY_PROG1'),
+                                         (0.05, 'short', 'KEY_PROG2')]
+
+
+def test_short_press_of_power_is_reported_on_release():
+    stream = """
+        0.000 KEY_POWER2 press
+        0.110 KEY_POWER2 repeat
+        0.150 KEY_POWER2 release
+    """
+    assert run(stream) == [(0.15, 'short', POWER)]
+
+
+def test_long_press_of_power():
+    stream = repeats(POWER, 0.0, 1.65) + "\n1.700 KEY_POWER2 release"
+    events = run(stream, long_press=1.0)
+    assert [(kind, key) for ts, kind, key in events] == [('long', POWER)]
+    # reported while the key is still held, not on release
+    assert 1.0 <= events[0][0] < 1.2
+
+
+def test_release_timeout_without_release_events():
+    # lircd: the press ends when the repeats stop
+    stream = repeats(POWER, 0.0, 0.33)
+    assert run(stream, release=0.6) == [(0.93, 'short', POWER)]
+
+
+def test_long_press_without_release_events():
+    stream = repeats(POWER, 0.0, 1.43) + "\n" + repeats(POWER, 3.0, 3.0)
+    events = run(stream, long_press=1.0, release=0.6)
+    assert [(kind, key) for ts, kind, key in events] == [
+        ('long', POWER), ('short', POWER)]
+    assert events[1][0] == 3.6
+
+
+def test_new_press_after_missed_release():
+    # the release timeout has not passed, but a new press ends the old one
+    stream = """
+        0.000 KEY_POWER2 press
+        0.400 KEY_POWER2 press
+    """
+    assert run(stream, debounce=0.3, release=0.6) == [
+        (0.4, 'short', POWER), (1.0, 'short', POWER)]
+
+
+class FakeSettings:
+    values = {'lirc_toggle': 'KEY_PROG1', 'lirc_switch': 'KEY_PROG2',
+              'lirc_power': POWER, 'lirc_socket': None, 'lirc_repeat': 0.3,
+              'lirc_power_timeout': 0, 'input': ''}
+
+    def get_setting(self, category, setting, default):
+        return self.values.get(setting, default)
+
+    get_settingb = get_settingi = get_settingf = get_setting
+
+
+class FakeSocket:
+    def __init__(self, data):
+        self.data = data
+
+    def recv(self, size):
+        return self.data
+
+
+def test_wall_clock_jump_does_not_affect_debounce(monkeypatch):
+    clock = {'wall': 1e9, 'monotonic': 100.0}
+    monkeypatch.setattr(time, 'time', lambda: clock['wall'])
+    monkeypatch.setattr(time, 'monotonic', lambda: clock['monotonic'])
+    debouncer = KeyDebouncer(debounce=0.3)
+    presses = []
+    lircd = lirc_socket.LircdInput(
+        FakeSettings(), lambda *event: presses.extend(debouncer.feed(*event)))
+
+    def send(key, repeat=0):
+        lircd.handler(FakeSocket(
+            b"0000000000000001 %02x %s rc\n" % (repeat, key.encode())))
+
+    send('KEY_OK')
+    # NTP steps the clock back an hour between two presses 1 s apart
+    clock['wall'] -= 3600
+    clock['monotonic'] += 1.0
+    send('KEY_OK')
+    # and forward again right before a bounce
+    clock['wall'] += 7200
+    clock['monotonic'] += 0.05
+    send('KEY_OK')
+    assert presses == [('short', 'KEY_OK'), ('short', 'KEY_OK')]
+
+
+class FakeMain:
+    current = 'vdr'
+    vdrStatus = 1
+
+    def __init__(self):
+        self.settings = FakeSettings()
+        self.metrics = Metrics()
+        self.switches = 0
+
+    def switchFrontend(self):
+        self.switches += 1
+
+    def status(self):
+        return 1
+
+    def cancel_timer(self):
+        pass
+
+
+def test_burst_of_switch_keys_is_coalesced(monkeypatch):
+    idle = []
+    monkeypatch.setattr(remote.GObject, 'idle_add',
+                        lambda func, *args: idle.append(func) or len(idle))
+    main = FakeMain()
+    control = RemoteControl(main)
+    stream = "\n".join("{0:.3f} KEY_PROG2 press".format(0.31 * n)
+                       for n in range(5))
+    for ts, kind, key in replay(stream.splitlines(), control.debouncer):
+        control.handle([(kind, key)])
+    # one dispatch for the whole burst, the main loop was busy meanwhile
+    assert len(idle) == 1
+    assert main.metrics.counters['keys_coalesced'] == 4
+    idle.pop()()
+    assert main.switches == 1
+    assert main.metrics.histograms['key'].count == 1
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Paint the X11 root window without forking feh.
+
+    Images are decoded and scaled to the root window size once in a worker
+    thread, the resulting pixmaps are kept in a small LRU cache per display
+    and size. Switching backgrounds then only sets the root window's
+    background pixmap. Needs python-xlib and Pillow; without them (or if
+    anything goes wrong) the caller falls back to feh.
+'''
+
+import collections
+import logging
+log = logging.getLogger(__name__)
+try:
+    from PIL import Image
+    from Xlib import X, Xatom
+    import Xlib.display
+except ImportError:
+    Image = None
+
+# keep single put_image requests well below the X11 request size limit
+CHUNK_BYTES = 64 * 1024
+
+
+def render(path, width, height):
+    """return BGRX pixel data of path scaled to fill width x height"""
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        scale = max(width / image.width, height / image.height)
+        size = (max(width, round(image.width * scale)),
+                max(height, round(image.height * scale)))
+        image = image.resize(size, Image.BILINEAR)
+        left = (image.width - width) // 2
+        top = (image.height - height) // 2
+        image = image.crop((left, top, left + width, top + height))
+        return image.convert('RGBX').tobytes('raw', 'BGRX')
+
+
+class BackgroundRenderer:
+    def __init__(self, executor, cache_size=4):
+        self.executor = executor
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # key -> pixmap
+        self.displays = {}  # display name -> Xlib.display.Display
+        self.rendering = set()
+        self.wanted = {}  # display name -> key of the newest request
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def get_display(self, name):
+        conn = self.displays.get(name)
+        if conn is None:
+            conn = Xlib.display.Display(name)
+            if conn.screen().root_depth not in (24, 32):
+                conn.close()
+                raise ValueError("unsupported color depth")
+            self.displays[name] = conn
+        return conn
+
+    def get_key(self, path, display_name):
+        conn = self.get_display(display_name)
+        root = conn.screen().root
+        geometry = root.get_geometry()
+        return (display_name, path, geometry.width, geometry.height)
+
+    def set_background(self, path, display_name, fallback):
+        """show path on display_name, fallback() is called if this is not
+        possible. Returns False if the renderer can't be used at all."""
+        if not self.available:
+            return False
+        try:
+            key = self.get_key(path, display_name)
+        except Exception as error:
+            log.warning("can't use X display %s: %s", display_name, error)
+            self.forget(display_name)
+            return False
+        self.wanted[display_name] = key
+        pixmap = self.cache.get(key)
+        if pixmap is not None:
+            self.cache.move_to_end(key)
+            try:
+                self.apply(key, pixmap)
+            except Exception as error:
+                log.warning("could not set background: %s", error)
+                self.forget(display_name)
+                return False
+        elif key not in self.rendering:
+            self.rendering.add(key)
+            self.executor.submit(
+                render, path, key[2], key[3],
+                callback=lambda data, error: self.on_rendered(
+                    key, data, error, fallback))
+        return True
+
+    def preload(self, paths, display_name):
+        """decode and scale paths ahead of time"""
+        if not self.available:
+            return
+        for path in paths:
+            try:
+                key = self.get_key(path, display_name)
+            except Exception as error:
+                log.warning("can't use X display %s: %s", display_name,
+                            error)
+                return
+            if key not in self.cache and key not in self.rendering:
+                self.rendering.add(key)
+                self.executor.submit(
+                    render, path, key[2], key[3],
+                    callback=lambda data, error, key=key: self.on_rendered(
+                        key, data, error, None))
+
+    def on_rendered(self, key, data, error, fallback):
+        self.rendering.discard(key)
+        if error is None:
+            try:
+                pixmap = self.create_pixmap(key, data)
+            except Exception as e:
+                error = e
+        if error is not None:
+            log.warning("could not render background %s: %s", key[1],
+                        error)
+            if fallback and self.wanted.get(key[0]) == key:
+                fallback()
+            return
+        self.cache[key] = pixmap
+        while len(self.cache) > self.cache_size:
+            old_key, old_pixmap = self.cache.popitem(last=False)
+            old_pixmap.free()
+        # only show it if no other background was requested meanwhile
+        if self.wanted.get(key[0]) == key:
+            try:
+                self.apply(key, pixmap)
+            except Exception as error:
+                log.warning("could not set background: %s", error)
+                self.forget(key[0])
+                if fallback:
+                    fallback()
+
+    def forget(self, display_name):
+        """drop the connection and cached pixmaps of display_name"""
+        for key in [key for key in self.cache if key[0] == display_name]:
+            del self.cache[key]
+        conn = self.displays.pop(display_name, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def create_pixmap(self, key, data):
+        display_name, path, width, height = key
+        conn = self.get_display(display_name)
+        screen = conn.screen()
+        pixmap = screen.root.create_pixmap(width, height, screen.root_depth)
+        gc = pixmap.create_gc()
+        rows = max(1, CHUNK_BYTES // (width * 4))
+        for y in range(0, height, rows):
+            n = min(rows, height - y)
+            pixmap.put_image(gc, 0, y, width, n, X.ZPixmap,
+                             screen.root_depth, 0,
+                             data[y * width * 4:(y + n) * width * 4])
+        gc.free()
+        return pixmap
+
+    def apply(self, key, pixmap):
+        conn = self.get_display(key[0])
+        root = conn.screen().root
+        root.change_attributes(background_pixmap=pixmap)
+        # let compositors and pseudo-transparent clients find the pixmap
+        for name in ('_XROOTPMAP_ID', 'ESETROOT_PMAP_ID'):
+            root.change_property(conn.intern_atom(name), Xatom.PIXMAP, 32,
+                                 [pixmap.id])
+        root.clear_area(0, 0, 0, 0)
+        conn.flush()
+        log.debug("background set to %s on %s", key[1], key[0])
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Read remote control keys directly from Linux input devices.
+
+    The devices are opened non-blocking and every wakeup reads all queued
+    events at once, so keys reach the frontend without a round trip
+    through lircd. Key codes are named like lircd's devinput driver does
+    (KEY_OK, KEY_PROG1, ...), so the lirc_* key settings work unchanged.
+'''
+
+from gi.repository import GObject
+import errno
+import glob
+import logging
+import os
+import re
+import struct
+import time
+from tools.remote import InputBackend
+log = logging.getLogger(__name__)
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+EVENT = struct.Struct('llHHi')
+EV_KEY = 0x01
+# read up to this many events per system call
+BATCH = 64
+HEADER = '/usr/include/linux/input-event-codes.h'
+
+
+def load_key_names():
+    """return a dict mapping key codes to names"""
+    try:
+        from evdev import ecodes
+        names = {}
+        for code, name in ecodes.KEY.items():
+            names[code] = name[0] if isinstance(name, list) else name
+        for code, name in ecodes.BTN.items():
+            names.setdefault(code,
+                             name[0] if isinstance(name, list) else name)
+        return names
+    except ImportError:
+        pass
+    names = {}
+    try:
+        with open(HEADER) as f:
+            for match in re.finditer(
+                    r'^#define\s+((?:KEY|BTN)_\w+)\s+(0x[0-9a-fA-F]+|\d+)',
+                    f.read(), re.M):
+                # the first name defined for a code wins, later ones are
+                # aliases like KEY_MIN_INTERESTING
+                names.setdefault(int(match.group(2), 0), match.group(1))
+    except OSError:
+        log.warning("%s not found, using numeric key codes", HEADER)
+    return names
+
+
+class EvdevInput(InputBackend):
+    """read keys from the input devices matching evdev_devices"""
+    def __init__(self, settings, callback):
+        super().__init__(settings, callback)
+        self.key_names = load_key_names()
+        self.devices = {}  # path -> (fd, watch)
+        self.retry = None
+        self.load_settings()
+        self.open_devices()
+
+    def load_settings(self):
+        self.pattern = self.settings.get_setting(
+            'Frontend', 'evdev_devices', '/dev/input/by-path/*-event-ir')
+
+    def open_devices(self):
+        self.retry = None
+        for path in sorted(glob.glob(self.pattern)):
+            if path in self.devices:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError as error:
+                log.warning("could not open %s: %s", path, error)
+                continue
+            watch = GObject.io_add_watch(fd, GObject.IO_IN | GObject.IO_HUP |
+                                         GObject.IO_ERR, self.handler, path)
+            self.devices[path] = (fd, watch)
+            log.info("reading keys from %s", path)
+        if not self.devices:
+            log.debug("no input device matches %s", self.pattern)
+            self.retry = GObject.timeout_add(1000, self.open_devices)
+        return False
+
+    def close_device(self, path):
+        fd, watch = self.devices.pop(path)
+        GObject.source_remove(watch)
+        os.close(fd)
+
+    def handler(self, fd, condition, path):
+        events = []
+        try:
+            while True:
+                data = os.read(fd, EVENT.size * BATCH)
+                if not data:
+                    break
+                events.extend(EVENT.iter_unpack(
+                    data[:len(data) - len(data) % EVENT.size]))
+                if len(data) < EVENT.size * BATCH:
+                    break
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                log.warning("lost input device %s: %s", path, error)
+                self.close_device(path)
+                if self.retry is None:
+                    self.retry = GObject.timeout_add(1000, self.open_devices)
+                return False
+        self.dispatch(events)
+        return True
+
+    def dispatch(self, events):
+        now = time.monotonic()
+        for sec, usec, ev_type, code, value in events:
+            # value: 0 = release, 1 = press, 2 = autorepeat
+            if ev_type != EV_KEY:
+                continue
+            key = self.key_names.get(code, 'KEY_{0}'.format(code))
+            self.callback(key, value == 2, now, released=value == 0)
+
+    def settings_changed(self, changed):
+        if ('Frontend', 'evdev_devices') in changed:
+            self.close()
+            self.load_settings()
+            self.open_devices()
+
+    def close(self):
+        if self.retry is not None:
+            GObject.source_remove(self.retry)
+            self.retry = None
+        for path in list(self.devices):
+            self.close_device(path)
+
+
+if __name__ == '__main__':
+    # print the key events of a device, e.g. a uinput stand-in
+    import sys
+
+    class PrintSettings:
+        def get_setting(self, category, setting, default):
+            return sys.argv[1] if len(sys.argv) > 1 else default
+
+    def print_key(key, repeat, timestamp, released=False):
+        # the format tools/remote.py replays
+        print("{0:.6f} {1} {2}".format(
+            timestamp, key,
+            "release" if released else "repeat" if repeat else "press"))
+
+    logging.basicConfig(level=logging.DEBUG)
+    EvdevInput(PrintSettings(), print_key)
+    GObject.MainLoop().run()
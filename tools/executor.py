@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Keep blocking work off the GObject main loop.
+
+    Functions submitted to the Executor run in a small thread pool,
+    spawned commands are reaped with GObject.child_watch_add. In both
+    cases the callback is run on the main loop.
+'''
+
+from gi.repository import GObject
+import concurrent.futures
+import logging
+import os
+import subprocess
+log = logging.getLogger(__name__)
+
+
+class Executor:
+    def __init__(self, workers=2):
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='frontend-worker')
+
+    def submit(self, func, *args, callback=None, **kwargs):
+        """run func(*args, **kwargs) in a worker thread and pass
+        (result, error) to callback on the main loop"""
+        future = self.pool.submit(func, *args, **kwargs)
+        if callback is not None:
+            future.add_done_callback(
+                lambda future: GObject.idle_add(self.deliver, future,
+                                                callback))
+        return future
+
+    def deliver(self, future, callback):
+        try:
+            result, error = future.result(), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            callback(result, error)
+        except Exception as e:
+            log.exception(e)
+        return False
+
+    def spawn(self, argv, callback=None, **kwargs):
+        """start argv without waiting for it, callback(returncode) runs on
+        the main loop once the process has exited"""
+        proc = subprocess.Popen(argv, stdin=subprocess.DEVNULL, **kwargs)
+        GObject.child_watch_add(proc.pid, self.on_exit, (proc, callback))
+        return proc
+
+    def on_exit(self, pid, condition, data):
+        proc, callback = data
+        # the child has already been reaped by GLib
+        proc.returncode = os.waitstatus_to_exitcode(condition)
+        if callback is not None:
+            try:
+                callback(proc.returncode)
+            except Exception as e:
+                log.exception(e)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
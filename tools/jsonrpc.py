@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Persistent JSON-RPC client for KODI's TCP interface (port 9090).
+
+    KODI sends bare JSON objects without any delimiter, so incoming data is
+    buffered and split at the end of each top level object. Replies are
+    matched to their requests by id, notifications (e.g. System.OnQuit) are
+    passed to registered handlers. A lost connection is re-established on
+    the next request.
+'''
+
+from gi.repository import GObject
+import codecs
+import itertools
+import json
+import logging
+import re
+import socket
+log = logging.getLogger(__name__)
+
+TOKENS = re.compile(r'[{}\[\]"\\]')
+
+
+class JSONRPCError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__("{0}: {1}".format(code, message))
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+class JSONRPCClient:
+    def __init__(self, host='localhost', port=9090, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.watch = None
+        self.ids = itertools.count(1)
+        self.pending = {}  # id -> callback(result, error)
+        self.handlers = {}  # notification method -> [callbacks]
+        self.reset_buffer()
+
+    def reset_buffer(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.buffer = ''
+        self.scan_pos = 0
+        self.msg_start = 0
+        self.depth = 0
+        self.in_string = False
+        self.skip = -1
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self):
+        if self.sock is not None:
+            return
+        self.sock = socket.create_connection((self.host, self.port),
+                                             self.timeout)
+        self.sock.setblocking(False)
+        self.reset_buffer()
+        self.watch = GObject.io_add_watch(
+            self.sock, GObject.IO_IN | GObject.IO_ERR | GObject.IO_HUP,
+            self.on_data)
+        log.debug("connected to JSON-RPC server %s:%s", self.host,
+                  self.port)
+
+    def close(self, reason="connection closed"):
+        if self.watch is not None:
+            GObject.source_remove(self.watch)
+            self.watch = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        pending, self.pending = self.pending, {}
+        for callback in pending.values():
+            if callback:
+                callback(None, ConnectionError(reason))
+
+    def on_notification(self, method, callback):
+        """call callback(params) for each notification named method"""
+        self.handlers.setdefault(method, []).append(callback)
+
+    def send(self, message):
+        self.connect()
+        data = json.dumps(message).encode()
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            # KODI may have been restarted, try a fresh connection once
+            self.close("connection lost")
+            self.connect()
+            self.sock.sendall(data)
+
+    def call_async(self, method, params=None, callback=None):
+        """send a request, callback(result, error) runs on the main loop
+        once the reply has arrived. Returns the request id."""
+        request_id = next(self.ids)
+        self.pending[request_id] = callback
+        try:
+            self.send({"jsonrpc": "2.0", "method": method,
+                       "params": params or {}, "id": request_id})
+        except OSError:
+            del self.pending[request_id]
+            raise
+        return request_id
+
+    def notify(self, method, params=None):
+        self.send({"jsonrpc": "2.0", "method": method,
+                   "params": params or {}})
+
+    def on_data(self, sock, condition):
+        if not self.read():
+            self.watch = None
+            return False
+        return True
+
+    def read(self):
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return True
+        except OSError as error:
+            data = b''
+            log.debug("JSON-RPC connection error: %s", error)
+        if not data:
+            log.debug("JSON-RPC server closed the connection")
+            self.close()
+            return False
+        for message in self.feed(data):
+            self.dispatch(message)
+        return True
+
+    def feed(self, data):
+        """return the complete messages buffered so far"""
+        buf = self.buffer + self.decoder.decode(data)
+        messages = []
+        for match in TOKENS.finditer(buf, self.scan_pos):
+            i = match.start()
+            if i == self.skip:
+                continue
+            c = match.group()
+            if self.in_string:
+                if c == '\\':
+                    self.skip = i + 1
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"' and self.depth > 0:
+                self.in_string = True
+            elif c in '{[':
+                if self.depth == 0:
+                    self.msg_start = i
+                self.depth += 1
+            elif c in '}]' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    messages.append(buf[self.msg_start:i + 1])
+        cut = self.msg_start if self.depth > 0 else len(buf)
+        self.buffer = buf[cut:]
+        self.scan_pos = len(buf) - cut
+        self.skip -= cut
+        self.msg_start = 0
+        parsed = []
+        for message in messages:
+            try:
+                parsed.append(json.loads(message))
+            except ValueError:
+                log.warning("invalid JSON-RPC message: %.200s", message)
+        return parsed
+
+    def dispatch(self, message):
+        if not isinstance(message, dict):
+            return
+        request_id = message.get('id')
+        if request_id in self.pending:
+            callback = self.pending.pop(request_id)
+            if not callback:
+                return
+            if 'error' in message:
+                error = message['error']
+                callback(None, JSONRPCError(error.get('code'),
+                                            error.get('message'),
+                                            error.get('data')))
+            else:
+                callback(message.get('result'), None)
+        elif 'method' in message:
+            for callback in self.handlers.get(message['method'], []):
+                try:
+                    callback(message.get('params'))
+                except Exception as error:
+                    log.exception(error)
+        else:
+            log.debug("unexpected JSON-RPC message: %s", message)
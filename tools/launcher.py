@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Start player processes without a shell.
+
+    The command of a frontend is split into argv once when its settings
+    are loaded. Players are executed directly, so the PID we supervise is
+    the player's own and no /bin/sh is forked first. File descriptors of
+    the frontend script are not inherited. The process options from the
+    frontend's config section (cgroup, CPU affinity, nice value, I/O
+    priority and SCHED_RR) are applied to all threads of the new process
+    right after it has been started and can be changed while it runs.
+'''
+
+import ctypes
+import errno
+import logging
+import os
+import platform
+import shlex
+import subprocess
+log = logging.getLogger(__name__)
+
+OPTIONS = ('cgroup', 'cpu_affinity', 'nice', 'ioprio', 'sched_rr')
+IOPRIO_CLASSES = {'none': 0, 'rt': 1, 'be': 2, 'idle': 3}
+IOPRIO_WHO_PROCESS = 1
+# there is no libc wrapper for ioprio_set, so it is called by number
+IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30,
+              'armv6l': 314, 'armv7l': 314}
+
+
+def split_command(command):
+    """return the argv of command like /bin/sh would split it, lines may
+    be continued with a backslash"""
+    return shlex.split(command.replace('\\\n', ' ').replace('\n', ' '))
+
+
+def parse_cpus(value):
+    """return the set of CPUs in a list like '0-1,3'"""
+    cpus = set()
+    for part in value.replace(' ', '').split(','):
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def parse_ioprio(value):
+    """return (class, level) for a value like 'be/4' or 'idle'"""
+    name, sep, level = value.partition('/')
+    return IOPRIO_CLASSES[name.strip()], int(level or 0)
+
+
+def set_ioprio(tid, ioprio_class, level):
+    number = IOPRIO_SET.get(platform.machine())
+    if number is None:
+        raise OSError(errno.ENOSYS, "ioprio_set is unknown on {0}".format(
+            platform.machine()))
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, tid,
+                    ioprio_class << 13 | level) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def set_sched_rr(tid, priority):
+    if priority:
+        os.sched_setscheduler(tid, os.SCHED_RR, os.sched_param(priority))
+    else:
+        os.sched_setscheduler(tid, os.SCHED_OTHER, os.sched_param(0))
+
+
+class Launcher:
+    def __init__(self, name):
+        self.name = name
+        self.argv = []
+        for option in OPTIONS:
+            setattr(self, option, None)
+
+    def configure(self, settings, section, command):
+        """take argv from command and the process options from section"""
+        self.argv = split_command(command)
+        for option in OPTIONS:
+            try:
+                self.set_option(option, settings.get_setting(section, option,
+                                                             None))
+            except (KeyError, ValueError):
+                log.error("invalid %s for %s in [%s]", option, self.name,
+                          section)
+        log.debug('%s command: %s', self.name, self.argv)
+
+    def set_option(self, option, value):
+        """set an option from its config file notation, None or an empty
+        string leave the process setting alone"""
+        if option not in OPTIONS:
+            raise KeyError(option)
+        if value is None or value == '':
+            parsed = None
+        elif option == 'cpu_affinity':
+            parsed = parse_cpus(value)
+        elif option in ('nice', 'sched_rr'):
+            parsed = int(value)
+        elif option == 'ioprio':
+            parsed = parse_ioprio(value)
+        else:
+            parsed = value
+        setattr(self, option, parsed)
+
+    def spawn(self, env=None):
+        proc = subprocess.Popen(self.argv, env=env, close_fds=True)
+        self.apply(proc.pid)
+        return proc
+
+    def apply(self, pid):
+        """apply the process options to all threads of pid"""
+        if self.cgroup:
+            self.try_set('cgroup', self.set_cgroup, [pid])
+        try:
+            tids = [int(tid) for tid in os.listdir(
+                '/proc/{0}/task'.format(pid))]
+        except OSError:
+            tids = [pid]
+        if self.cpu_affinity:
+            self.try_set('cpu_affinity', self.set_affinity, tids)
+        if self.nice is not None:
+            self.try_set('nice', self.set_nice, tids)
+        if self.ioprio is not None:
+            self.try_set('ioprio', self.set_ioprio, tids)
+        if self.sched_rr is not None:
+            self.try_set('sched_rr', self.set_sched_rr, tids)
+
+    def try_set(self, option, func, tids):
+        try:
+            for tid in tids:
+                func(tid)
+        except OSError as error:
+            log.warning("could not set %s of %s: %s", option, self.name,
+                        error)
+
+    def set_cgroup(self, pid):
+        with open(os.path.join(self.cgroup, 'cgroup.procs'), 'w') as f:
+            f.write(str(pid))
+
+    def set_affinity(self, tid):
+        os.sched_setaffinity(tid, self.cpu_affinity)
+
+    def set_nice(self, tid):
+        os.setpriority(os.PRIO_PROCESS, tid, self.nice)
+
+    def set_ioprio(self, tid):
+        set_ioprio(tid, *self.ioprio)
+
+    def set_sched_rr(self, tid):
+        set_sched_rr(tid, self.sched_rr)
@@ -6,165 +6,175 @@ from gi.repository import GObject
 import logging
 import socket
 import time
-from dbus.mainloop.glib import DBusGMainLoop
-DBusGMainLoop(set_as_default=True)
-
-
-class lircConnection():
-    def __init__(self, main):
-        self.main = main
-        self.main.timer = None
-        self.socket_path = self.main.settings.get_setting('Frontend',
-                                                          'lirc_socket',
-                                                          None)
-        self.delta_t = self.main.settings.get_settingf('Frontend',
-                                                       'lirc_repeat', 0.300)
-        logging.debug("lirc_socket is {0}".format(self.socket_path))
-        if self.socket_path is None:
-            return
-        self.try_connection()
-        self.callback = None
-        logging.debug("lirc_toggle = {0}".format(
-            self.main.settings.get_setting("Frontend", "lirc_toggle", None)))
-        logging.debug("lirc_switch = {0}".format(
-            self.main.settings.get_setting("Frontend", "lirc_switch", None)))
-        logging.debug("lirc_power = {0}".format(
-            self.main.settings.get_setting("Frontend", "lirc_power", None)))
-        self.last_key = None
-        self.last_ts = time.time()
-        self.min_delta = 0.300
+from tools.remote import InputBackend
+log = logging.getLogger(__name__)
+
+
+class LircdInput(InputBackend):
+    """read keys from the lircd socket"""
+    def __init__(self, settings, callback):
+        super().__init__(settings, callback)
+        self.socket_path = self.settings.get_setting('Frontend',
+                                                     'lirc_socket', None)
+        log.debug("lirc_socket is %s", self.socket_path)
+        self.sock = None
+        self.watch = None
+        self.retry = None
+        self.buffer = b''
+        if self.socket_path is not None:
+            self.try_connection()
 
     def connect_lircd(self):
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.sock.connect(self.socket_path)
-        self.callback = GObject.io_add_watch(self.sock, GObject.IO_IN,
-                                             self.handler)
+        self.watch = GObject.io_add_watch(self.sock, GObject.IO_IN,
+                                          self.handler)
 
     def try_connection(self):
-        logging.debug("try_connection")
+        log.debug("try_connection")
+        self.retry = None
         try:
             self.connect_lircd()
-            logging.info("conntected to Lirc-Socket on %s" % (self.socket_path)
-                         )
-            return False
-        except:
-            GObject.timeout_add(1000, self.try_connection)
-            try:
-                if self.callback:
-                    logging.debug("lirc_socket.py: remove callback function")
-                    GObject.source_remove(self.callback)
-            except:
-                logging.exception(
-                    "vdr-frontend could not connect to lircd socket")
-                pass
-            return False
+            log.info("conntected to Lirc-Socket on %s", self.socket_path)
+        except OSError:
+            log.debug("vdr-frontend could not connect to lircd socket")
+            self.sock.close()
+            self.sock = None
+            self.retry = GObject.timeout_add(1000, self.try_connection)
+        return False
 
     def read_from_socket(self, sock):
         buf = sock.recv(1024)
         if not buf:
-            logging.debug("read_from_socket(): call reset_lirc")
+            log.debug("read_from_socket(): call reset_lirc")
             self.reset_lirc(sock)
         else:
             return buf
 
+    def disconnect(self):
+        if self.watch is not None:
+            GObject.source_remove(self.watch)
+            self.watch = None
+        if self.retry is not None:
+            GObject.source_remove(self.retry)
+            self.retry = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.buffer = b''
+
     def reset_lirc(self, sock):
-        sock.close()
-        try:
-            GObject.source_remove(self.callback)
-        except:
-            pass
-        logging.exception('retry lirc connection')
+        self.disconnect()
+        log.warning('lost connection to lircd, retrying')
         self.try_connection()
 
     def handler(self, sock, *args):
         '''callback function for activity on lircd socket'''
         try:
             buf = self.read_from_socket(sock)
-        except:
-            logging.debug("handler: call reset_lirc")
-            self.reset_lirc()
-            return True
-        if buf:
-            lines = buf.decode().split("\n")
-            for line in lines:
-                if len(line) > 0:
-                    try:
-                        self.get_key(line)
-                    except:
-                        logging.exception("could not parse: %s" % line)
+        except OSError:
+            log.debug("handler: call reset_lirc")
+            self.reset_lirc(sock)
+            return False
+        if not buf:
+            return False
+        # keep an incomplete last line until the next read
+        lines = (self.buffer + buf).split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            if line:
+                self.get_key(line)
         return True
 
     def get_key(self, line):
-        logging.debug("got a key press")
-        logging.debug("line: %s" % line)
-        code, count, cmd, device = line.split(" ")[:4]
-        timestamp = self.last_ts
-        previous_key = self.last_key
-        self.last_key = cmd
-        self.last_ts = time.time()
-        if count != "0":
-            logging.debug('repeated keypress')
-            return
-        elif (self.last_ts - timestamp < self.delta_t and
-              self.last_key == previous_key):
-            logging.debug('ignoring keypress within min_delta')
+        try:
+            code, count, cmd, device = line.decode(
+                errors='replace').split(" ")[:4]
+            count = int(count, 16)
+        except ValueError:
+            log.warning("could not parse: %s", line)
             return
-        else:
-            try:
-                logging.debug("remove main.timer")
-                GObject.source_remove(self.main.timer)
-            except:
-                logging.debug("could not remove timer")
-        logging.debug('Key press: %s', cmd)
-        logging.debug("current frontend: %s", self.main.current)
-        if self.main.current == 'vdr':
-            self.vdr_key_action(code, count, cmd, device)
-        elif self.main.current == 'kodi':
-            self.kodi_key_action(code, count, cmd, device)
-        else:
-            logging.debug("keypress for other frontend")
-            logging.debug("current frontend is: %s" % self.main.current)
-            logging.debug("vdrStatus is: %s" % self.main.vdrStatus)
-            logging.debug("frontend status is: %s" % self.main.status())
-
-    def vdr_key_action(self, code, count, cmd, device):
-        logging.debug("keypress for vdr")
-        if cmd == self.main.settings.get_setting("Frontend",
-                                                 "lirc_toggle", None):
-            logging.debug("lirc_socket.py: toggleFrontend")
-            self.main.toggleFrontend()
-        elif cmd == self.main.settings.get_setting("Frontend",
-                                                   'lirc_switch', None):
-            logging.debug("lirc_socket.py: switchFrontend")
-            self.main.switchFrontend()
-
-        elif cmd == self.main.settings.get_setting("Frontend",
-                                                   'lirc_power', None):
-            if self.main.status() == 1:
-                self.main.timer = GObject.timeout_add(15000,
-                                                      self.main.soft_detach)
-            else:
-                self.main.send_shutdown()
-        elif self.main.status() != 1:
-            logging.debug("main status is: %s" % self.main.status)
-            self.main.resume()
-        else:
-            logging.debug("lic_socket.py: no action necessary")
-
-    def kodi_key_action(self, code, count, cmd, device):
-        logging.debug("keypress for kodi")
-        if cmd == self.main.settings.get_setting("Frontend",
-                                                 'lirc_switch', None):
-            logging.info('lirc_socket.py: switch from KODI to VDR')
-            self.main.switchFrontend()
-        elif cmd == self.main.settings.get_setting("Frontend",
-                                                   'lirc_power', None):
-            if self.main.status() == 1:
-                self.main.wants_shutdown = True
-                self.main.init_shutdown()
-                self.main.timer = GObject.timeout_add(
-                    15000, self.main.soft_detach)
-        elif self.main.status() != 1:
-            logging.debug("main status is: %s" % self.main.status)
-            self.main.resume()
-        return True
+        try:
+            self.callback(cmd, count, time.monotonic())
+        except Exception:
+            # keep the watch, the next key may work
+            log.exception("handling %s failed", cmd)
+
+    def settings_changed(self, changed):
+        socket_path = self.settings.get_setting('Frontend', 'lirc_socket',
+                                                None)
+        if socket_path != self.socket_path:
+            self.disconnect()
+            self.socket_path = socket_path
+            if socket_path is not None:
+                self.try_connection()
+
+    def close(self):
+        self.disconnect()
+
+
+if __name__ == '__main__':
+    # micro-benchmark: feed a flood of repeat events through the parser
+    import sys
+    from tools.metrics import Metrics
+    from tools.remote import RemoteControl
+
+    class BenchSettings:
+        values = {'lirc_toggle': 'KEY_PROG1', 'lirc_switch': 'KEY_PROG2',
+                  'lirc_power': 'KEY_POWER2', 'lirc_socket': None,
+                  'lirc_repeat': 0.0, 'lirc_power_timeout': 0}
+
+        def get_setting(self, category, setting, default):
+            return self.values.get(setting, default)
+
+        # the values above already have the right types
+        get_settingb = get_settingi = get_settingf = get_setting
+
+    class BenchMain:
+        settings = BenchSettings()
+        metrics = Metrics()
+        current = 'vdr'
+        timer = None
+        actions = 0
+        latency = 0.0
+
+        def toggleFrontend(self):
+            BenchMain.actions += 1
+            BenchMain.latency += time.perf_counter() - BenchMain.sent
+
+        def status(self):
+            return 1
+
+        def cancel_timer(self):
+            pass
+
+    presses = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = 20
+    remote = RemoteControl(BenchMain())
+    # run actions right away instead of on the idle main loop
+    remote.queue = lambda action: action()
+    lirc = remote.backends['lircd']
+    burst = b"".join(b"0000000000000001 %02x KEY_PROG1 rc\n" % n
+                     for n in range(repeats + 1))
+
+    class BenchSocket:
+        # split each burst in the middle of a line like a short read would
+        chunks = (burst[:17], burst[17:])
+
+        def recv(self, size):
+            return self.chunks[self.n]
+
+    sock = BenchSocket()
+    start = time.perf_counter()
+    for n in range(presses):
+        BenchMain.sent = time.perf_counter()
+        sock.n = 0
+        lirc.handler(sock)
+        sock.n = 1
+        lirc.handler(sock)
+    duration = time.perf_counter() - start
+    lines = presses * (repeats + 1)
+    print("{0} lines in {1:.3f} s: {2:.0f} lines/s".format(
+        lines, duration, lines / duration))
+    print("mean key to action latency: {0:.1f} us".format(
+        BenchMain.latency / BenchMain.actions * 1e6))
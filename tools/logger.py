@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Log through a queue so the main loop never waits for the log file.
+
+    Records are put on a queue by a QueueHandler on the root logger and a
+    QueueListener thread formats them and writes them to the console or to
+    a log file that is rotated by size. Records can be written as text or
+    as one JSON object per line. Messages take their arguments lazily
+    (log.debug("key %s", key)), so nothing is formatted for levels that
+    are switched off. The level of each module's logger can be set in
+    [Logging] levels and changed at runtime via D-Bus.
+'''
+
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+TEXT_FORMAT = '%(asctime)-15s %(levelname)-6s %(name)s: %(message)s'
+
+
+class JSONFormatter(logging.Formatter):
+    """format a record as a single line JSON object"""
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                  time.localtime(record.created)) +
+            '.{0:03d}'.format(int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def parse_level(level):
+    """return the numeric value of a level name like 'debug'"""
+    value = logging.getLevelName(str(level).strip().upper())
+    if not isinstance(value, int):
+        raise ValueError("unknown log level: {0}".format(level))
+    return value
+
+
+def parse_levels(value):
+    """return {logger: level} for a value like 'tools.remote:DEBUG,...'"""
+    levels = {}
+    for item in value.replace(' ', '').split(','):
+        if not item:
+            continue
+        name, sep, level = item.rpartition(':')
+        levels[name] = parse_level(level)
+    return levels
+
+
+class LogManager:
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.handler = logging.handlers.QueueHandler(self.queue)
+        self.listener = None
+        self.levels = {}  # logger name -> level set by the config file
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+
+    def configure(self, settings):
+        """(re)create the output handler from the [Logging] settings"""
+        if settings.get_settingb('Logging', 'use_file', False):
+            handler = logging.handlers.RotatingFileHandler(
+                settings.get_setting('Logging', 'logfile',
+                                     '/tmp/frontend.log'),
+                maxBytes=int(settings.get_settingf('Logging', 'max_size',
+                                                   1.0) * 1024 * 1024),
+                backupCount=settings.get_settingi('Logging', 'backups', 3),
+                encoding='utf-8')
+        else:
+            handler = logging.StreamHandler()
+        if settings.get_setting('Logging', 'format', 'text') == 'json':
+            handler.setFormatter(JSONFormatter())
+        else:
+            handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        self.stop()
+        self.listener = logging.handlers.QueueListener(self.queue, handler)
+        self.listener.start()
+        try:
+            level = parse_level(settings.get_setting('Logging', 'loglevel',
+                                                     'INFO'))
+        except ValueError as error:
+            logging.getLogger(__name__).error("%s", error)
+            level = logging.INFO
+        logging.getLogger().setLevel(level)
+        for name in self.levels:
+            logging.getLogger(name).setLevel(logging.NOTSET)
+        try:
+            self.levels = parse_levels(settings.get_setting('Logging',
+                                                            'levels', ''))
+        except ValueError as error:
+            logging.getLogger(__name__).error("%s", error)
+            self.levels = {}
+        for name, level in self.levels.items():
+            logging.getLogger(name).setLevel(level)
+
+    def set_level(self, name, level):
+        """set the level of logger name, '' is the root logger"""
+        logging.getLogger(name or None).setLevel(parse_level(level))
+
+    def get_levels(self):
+        """return {logger: level name} of all loggers with a level"""
+        loggers = [('', logging.getLogger())]
+        loggers += [(name, logger) for name, logger in
+                    logging.Logger.manager.loggerDict.items()
+                    if isinstance(logger, logging.Logger)]
+        return {name: logging.getLevelName(logger.level)
+                for name, logger in sorted(loggers)
+                if logger.level != logging.NOTSET}
+
+    def stop(self):
+        """write all queued records and stop the listener"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener.handlers[0].close()
+            self.listener = None
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Latency histograms and counters for frontend operations.
+
+    Operations are timed with Metrics.timed() or, if they complete in a
+    later callback, with Metrics.start() and Metrics.stop(). The collected
+    data is returned by the getMetrics D-Bus method and can be written to
+    a text file in Prometheus exposition format by a PrometheusWriter.
+'''
+
+from gi.repository import GObject
+import bisect
+import contextlib
+import logging
+import os
+import time
+log = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """return the upper bound of the bucket holding the p-th
+        percentile (capped by the largest value seen)"""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': float(self.count),
+            'sum': self.sum,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class Metrics:
+    def __init__(self, instance=0):
+        self.instance = instance
+        self.histograms = {}
+        self.counters = {}
+        self.spans = {}
+        self.dirty = False
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+        self.dirty = True
+        log.debug("%s took %.3f s", name, seconds)
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        self.dirty = True
+
+    def set(self, name, value):
+        self.counters[name] = value
+        self.dirty = True
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start)
+
+    def start(self, name):
+        """start timing an operation that is finished by stop(name)"""
+        self.spans[name] = time.monotonic()
+
+    def stop(self, name):
+        start = self.spans.pop(name, None)
+        if start is not None:
+            self.observe(name, time.monotonic() - start)
+
+    def cancel(self, name):
+        self.spans.pop(name, None)
+
+    def snapshot(self):
+        data = {name: histogram.summary()
+                for name, histogram in self.histograms.items()}
+        for name, value in self.counters.items():
+            data[name] = {'value': float(value)}
+        return data
+
+
+def format_prometheus(metrics):
+    """return the data of a list of Metrics in Prometheus text format,
+    labelled with their vdr instance"""
+    histograms = {}
+    counters = {}
+    for m in metrics:
+        for name, histogram in m.histograms.items():
+            histograms.setdefault(name, []).append((m.instance, histogram))
+        for name, value in m.counters.items():
+            counters.setdefault(name, []).append((m.instance, value))
+    lines = []
+    for name, instances in sorted(histograms.items()):
+        metric = 'frontend_{0}_seconds'.format(name)
+        lines.append('# TYPE {0} histogram'.format(metric))
+        for instance, histogram in instances:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(
+                    '{0}_bucket{{instance="{1}",le="{2}"}} {3}'.format(
+                        metric, instance, le, cumulative))
+            lines.append('{0}_sum{{instance="{1}"}} {2}'.format(
+                metric, instance, histogram.sum))
+            lines.append('{0}_count{{instance="{1}"}} {2}'.format(
+                metric, instance, histogram.count))
+    for name, instances in sorted(counters.items()):
+        metric = 'frontend_{0}'.format(name)
+        lines.append('# TYPE {0} gauge'.format(metric))
+        for instance, value in instances:
+            lines.append('{0}{{instance="{1}"}} {2}'.format(metric, instance,
+                                                           value))
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusWriter:
+    def __init__(self, path, metrics, interval=60):
+        self.path = path
+        self.metrics = metrics
+        GObject.timeout_add_seconds(interval, self.write)
+
+    def write(self):
+        if not any(m.dirty for m in self.metrics):
+            return True
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(format_prometheus(self.metrics))
+            os.replace(tmp, self.path)
+            for m in self.metrics:
+                m.dirty = False
+        except OSError as error:
+            log.warning("could not write metrics to %s: %s", self.path,
+                        error)
+        return True
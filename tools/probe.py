@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Wait for a TCP port to accept connections without blocking the main loop.
+
+    Each attempt is a non-blocking connect watched with GObject.io_add_watch.
+    Failed attempts are retried with exponential backoff until the deadline.
+'''
+
+from gi.repository import GObject
+import errno
+import logging
+import socket
+import time
+log = logging.getLogger(__name__)
+
+
+class PortProbe:
+    def __init__(self, host, port, timeout=30, interval=0.05,
+                 max_interval=1.0):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.sock = None
+        self.watch = None
+        self.timer = None
+        self.callback = None
+        self.deadline = None
+        self.delay = interval
+        self.attempts = 0
+        self.started = None
+
+    @property
+    def running(self):
+        return self.callback is not None
+
+    def start(self, callback, *args):
+        """call callback(ready, *args) as soon as the port accepts a
+        connection (ready=True) or after the deadline (ready=False)"""
+        self.cancel()
+        self.callback = (callback, args)
+        self.deadline = time.monotonic() + self.timeout
+        self.delay = self.interval
+        self.attempts = 0
+        self.started = time.monotonic()
+        self.connect()
+
+    def cancel(self):
+        self.close()
+        if self.timer is not None:
+            GObject.source_remove(self.timer)
+            self.timer = None
+        self.callback = None
+
+    def close(self):
+        if self.watch is not None:
+            GObject.source_remove(self.watch)
+            self.watch = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def connect(self):
+        self.timer = None
+        self.attempts += 1
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        err = self.sock.connect_ex((self.host, self.port))
+        if err == 0:
+            self.finish(True)
+        elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.watch = GObject.io_add_watch(
+                self.sock, GObject.IO_OUT | GObject.IO_ERR | GObject.IO_HUP,
+                self.on_connect)
+            # don't wait on a silently dropped SYN beyond the deadline
+            self.timer = GObject.timeout_add(
+                int(self.remaining() * 1000), self.retry)
+        else:
+            self.retry()
+        return False
+
+    def on_connect(self, sock, condition):
+        self.watch = None
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err == 0:
+            self.finish(True)
+        else:
+            if self.timer is not None:
+                GObject.source_remove(self.timer)
+                self.timer = None
+            self.retry()
+        return False
+
+    def remaining(self):
+        return max(self.deadline - time.monotonic(), 0)
+
+    def retry(self):
+        self.close()
+        self.timer = None
+        remaining = self.remaining()
+        if remaining <= 0:
+            self.finish(False)
+            return False
+        delay = min(self.delay, remaining)
+        self.delay = min(self.delay * 2, self.max_interval)
+        self.timer = GObject.timeout_add(int(delay * 1000), self.connect)
+        return False
+
+    def finish(self, ready):
+        callback, args = self.callback
+        duration = time.monotonic() - self.started
+        if ready:
+            log.debug("%s:%s accepts connections after %.3f s "
+                      "(%d attempts)", self.host, self.port, duration,
+                      self.attempts)
+        else:
+            log.warning("%s:%s not reachable within %s s",
+                        self.host, self.port, self.timeout)
+        self.cancel()
+        callback(ready, *args)
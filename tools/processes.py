@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Watch player processes through pidfds.
+
+    Players started by the frontends are registered with the
+    ProcessSupervisor of their vdr instance. The main loop watches a pidfd
+    of each process, so its exit is seen at once and the child is reaped
+    with a non-blocking waitpid. A process is starting until it is ready,
+    running until it is asked to stop, then exiting until it is dead.
+    stop() asks it to quit and escalates to further signals (SIGKILL by
+    default) if it is still there after each deadline. Without pidfd
+    support (Linux < 5.3) GObject.child_watch_add is used instead.
+    Python 3.9 or newer is needed (os.pidfd_open,
+    os.waitstatus_to_exitcode).
+'''
+
+from gi.repository import GObject
+import logging
+import os
+import signal
+import time
+log = logging.getLogger(__name__)
+
+STARTING = 'starting'
+RUNNING = 'running'
+EXITING = 'exiting'
+DEAD = 'dead'
+# wait status reported if the real one is lost: exit code 255, which the
+# frontends treat as a crash
+UNKNOWN_STATUS = 255 << 8
+
+
+class Process:
+    def __init__(self, supervisor, name, proc, on_exit, data):
+        self.supervisor = supervisor
+        self.name = name
+        self.proc = proc
+        self.on_exit = on_exit
+        self.data = data
+        self.state = STARTING
+        self.started = time.monotonic()
+        self.condition = None  # wait status once dead
+        self.pidfd = None
+        self.watch = None
+        self.deadline = None
+        self.escalation = []  # (signal, timeout) left to send on deadlines
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    @property
+    def alive(self):
+        """True until the process has been reaped"""
+        return self.state != DEAD
+
+    @property
+    def running(self):
+        """True if the process is alive and not asked to stop"""
+        return self.state in (STARTING, RUNNING)
+
+    def uptime(self):
+        return time.monotonic() - self.started
+
+    def ready(self):
+        if self.state == STARTING:
+            self.state = RUNNING
+            log.debug("%s (pid %s) is running after %.3f s", self.name,
+                      self.pid, self.uptime())
+        return False
+
+    def send_signal(self, signum):
+        """send signum, return False if the process is gone"""
+        if self.state == DEAD:
+            return False
+        try:
+            if self.pidfd is not None:
+                # the pidfd can't refer to a recycled pid
+                signal.pidfd_send_signal(self.pidfd, signum)
+            else:
+                os.kill(self.pid, signum)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def stop(self, timeout, signum=signal.SIGTERM,
+             escalation=((signal.SIGKILL, None),)):
+        """send signum (None if the process was asked to quit some other
+        way). If the process is alive after timeout seconds the next
+        (signal, timeout) of escalation is sent and so on."""
+        if self.state == DEAD:
+            return
+        self.state = EXITING
+        if signum is not None:
+            self.send_signal(signum)
+        if self.deadline is None:
+            self.escalation = list(escalation)
+            self.arm(timeout)
+
+    def arm(self, timeout):
+        self.deadline = GObject.timeout_add(int(timeout * 1000),
+                                            self.on_deadline, timeout)
+
+    def kill(self):
+        if self.state != DEAD:
+            self.state = EXITING
+        self.send_signal(signal.SIGKILL)
+
+    def on_deadline(self, timeout):
+        self.deadline = None
+        if not self.escalation:
+            return False
+        signum, next_timeout = self.escalation.pop(0)
+        log.warning("%s (pid %s) did not stop within %s s, sending %s",
+                    self.name, self.pid, timeout, signal.Signals(signum).name)
+        if signum == signal.SIGKILL:
+            self.supervisor.metrics.inc('processes_killed')
+        self.send_signal(signum)
+        if next_timeout is not None and self.state != DEAD:
+            self.arm(next_timeout)
+        return False
+
+    def exited(self, condition):
+        self.state = DEAD
+        self.condition = condition
+        if self.deadline is not None:
+            GObject.source_remove(self.deadline)
+            self.deadline = None
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+        # subprocess must not try to wait for it again
+        self.proc.returncode = os.waitstatus_to_exitcode(condition)
+        self.on_exit(self.pid, condition, self.data)
+
+
+class ProcessSupervisor:
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.processes = {}  # pid -> Process
+
+    def spawn(self, launcher, env, on_exit, data=None, ready=True):
+        """start launcher's command and watch it, on_exit(pid, condition,
+        data) is called once it has been reaped; with ready=False the
+        process stays starting until Process.ready() is called"""
+        return self.watch(launcher.name, launcher.spawn(env), on_exit,
+                          data, ready)
+
+    def watch(self, name, proc, on_exit, data=None, ready=True):
+        process = Process(self, name, proc, on_exit, data)
+        if data is None:
+            process.data = process
+        self.processes[proc.pid] = process
+        try:
+            process.pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            process.watch = GObject.child_watch_add(proc.pid, self.on_child,
+                                                    process)
+        else:
+            process.watch = GObject.io_add_watch(process.pidfd,
+                                                 GObject.IO_IN,
+                                                 self.on_pidfd, process)
+        if ready:
+            GObject.idle_add(process.ready)
+        return process
+
+    def on_pidfd(self, fd, condition, process):
+        try:
+            pid, status = os.waitpid(process.pid, os.WNOHANG)
+        except ChildProcessError:
+            # someone else has reaped it already
+            returncode = process.proc.returncode
+            pid = process.pid
+            if returncode is None:
+                log.warning("%s (pid %s) was reaped elsewhere, its exit "
+                            "status is unknown", process.name, pid)
+                status = UNKNOWN_STATUS
+            elif returncode < 0:
+                status = -returncode
+            else:
+                status = returncode << 8
+        if pid == 0:
+            return True
+        self.reaped(process, status)
+        return False
+
+    def on_child(self, pid, condition, process):
+        self.reaped(process, condition)
+
+    def reaped(self, process, condition):
+        self.processes.pop(process.pid, None)
+        process.watch = None
+        log.debug("%s (pid %s) reaped after %.1f s", process.name,
+                  process.pid, process.uptime())
+        process.exited(condition)
+
+    def status(self):
+        """return {name: (state, pid, uptime)} of the live processes"""
+        return {process.name: (process.state, pid, process.uptime())
+                for pid, process in self.processes.items()}
@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Map remote control keys to frontend actions.
+
+    Keys are read by input backends (lircd socket, evdev devices) which
+    pass (key, repeat, timestamp) to RemoteControl.on_key. Timestamps are
+    time.monotonic() values, so debouncing is not affected by changes of
+    the wall clock.
+
+    KeyDebouncer turns these events into short and long presses. It only
+    works on the timestamps it is given, so recorded key streams can be
+    replayed through it: python3 -m tools.remote recorded.txt
+'''
+
+from gi.repository import GObject
+import importlib
+import logging
+import time
+log = logging.getLogger(__name__)
+
+# input setting -> (module, class)
+BACKENDS = {
+    'lircd': ('tools.lirc_socket', 'LircdInput'),
+    'evdev': ('tools.evdev_input', 'EvdevInput'),
+}
+
+
+class InputBackend:
+    """base class of the input backends, callback(key, repeat, timestamp,
+    released=False) is called on the main loop for every key event"""
+    def __init__(self, settings, callback):
+        self.settings = settings
+        self.callback = callback
+
+    def settings_changed(self, changed):
+        pass
+
+    def close(self):
+        pass
+
+
+class KeyState:
+    __slots__ = ('pressed', 'last', 'long_fired')
+
+    def __init__(self, timestamp):
+        self.pressed = timestamp
+        self.last = timestamp
+        self.long_fired = False
+
+
+class KeyDebouncer:
+    """turn key events into ('short', key) and ('long', key) presses
+
+    Presses of the same key within debounce seconds are dropped. Keys in
+    long_keys are held back until they are released (or no repeat has
+    been seen for release seconds) to tell short from long presses, all
+    other keys are reported on the first event."""
+    def __init__(self, debounce=0.3, long_press=1.0, release=0.6,
+                 long_keys=()):
+        self.debounce = debounce
+        self.long_press = long_press
+        self.release = release
+        self.long_keys = set(long_keys)
+        self.held = {}  # key -> KeyState
+        self.last_press = {}  # key -> timestamp of the last accepted press
+
+    def feed(self, key, repeat, timestamp, released=False):
+        events = self.tick(timestamp)
+        state = self.held.get(key)
+        if released:
+            if state is not None:
+                events.extend(self.release_key(key))
+            return events
+        if repeat:
+            if state is not None:
+                state.last = timestamp
+                if (not state.long_fired and
+                        timestamp - state.pressed >= self.long_press):
+                    state.long_fired = True
+                    events.append(('long', key))
+            return events
+        if state is not None:
+            # missed the release of the previous press
+            events.extend(self.release_key(key))
+        last_press = self.last_press.get(key)
+        if last_press is not None and timestamp - last_press < self.debounce:
+            log.debug('ignoring keypress within lirc_repeat')
+            return events
+        self.last_press[key] = timestamp
+        if key in self.long_keys:
+            self.held[key] = KeyState(timestamp)
+        else:
+            events.append(('short', key))
+        return events
+
+    def tick(self, now):
+        """release held keys without a repeat for release seconds"""
+        events = []
+        for key, state in list(self.held.items()):
+            # same expression as in next_deadline() to avoid rounding
+            if state.last + self.release <= now:
+                events.extend(self.release_key(key))
+        return events
+
+    def release_key(self, key):
+        state = self.held.pop(key)
+        return [] if state.long_fired else [('short', key)]
+
+    def next_deadline(self):
+        """return when tick() has to be called next or None"""
+        if not self.held:
+            return None
+        return min(state.last for state in self.held.values()) + self.release
+
+
+class RemoteControl:
+    def __init__(self, main):
+        self.main = main
+        self.debouncer = KeyDebouncer()
+        self.tick_timer = None
+        self.pending = []  # actions waiting to run on the main loop
+        self.dispatch_source = None
+        self.backends = {}
+        self.load_settings()
+
+    def load_settings(self):
+        settings = self.main.settings
+        self.debouncer.debounce = settings.get_settingf('Frontend',
+                                                        'lirc_repeat', 0.300)
+        self.debouncer.long_press = settings.get_settingf(
+            'Frontend', 'lirc_long_press', 1.0)
+        self.debouncer.release = settings.get_settingf('Frontend',
+                                                       'lirc_release', 0.6)
+        self.power_timeout = settings.get_settingi('Frontend',
+                                                   'lirc_power_timeout', 15)
+        self.build_keymap()
+        names = self.main.settings.get_setting('Frontend', 'input', 'lircd')
+        wanted = [name.strip() for name in names.split(',') if name.strip()]
+        for name in list(self.backends):
+            if name not in wanted:
+                self.backends.pop(name).close()
+        for name in wanted:
+            if name in self.backends:
+                continue
+            try:
+                module, cls = BACKENDS[name]
+                backend = getattr(importlib.import_module(module), cls)
+                self.backends[name] = backend(self.main.settings, self.on_key)
+            except Exception as error:
+                log.error("could not use input backend %s: %s", name,
+                          error)
+
+    def settings_changed(self, changed):
+        self.load_settings()
+        for backend in self.backends.values():
+            backend.settings_changed(changed)
+
+    def build_keymap(self):
+        """map key names to actions once instead of looking them up in the
+        settings for every key press"""
+        toggle = self.main.settings.get_setting("Frontend", "lirc_toggle",
+                                                None)
+        switch = self.main.settings.get_setting("Frontend", "lirc_switch",
+                                                None)
+        power = self.main.settings.get_setting("Frontend", "lirc_power",
+                                               None)
+        log.debug("lirc_toggle = %s", toggle)
+        log.debug("lirc_switch = %s", switch)
+        log.debug("lirc_power = %s", power)
+        vdr_keys = ((toggle, self.toggle), (switch, self.switch),
+                    (power, self.vdr_power))
+        kodi_keys = ((switch, self.switch), (power, self.kodi_power))
+        self.keymap = {
+            'vdr': {key: action for key, action in reversed(vdr_keys)
+                    if key},
+            'kodi': {key: action for key, action in reversed(kodi_keys)
+                     if key},
+        }
+        # holding lirc_power detaches right away
+        self.long_keymap = {
+            'vdr': {power: self.vdr_power_long} if power else {},
+            'kodi': {power: self.kodi_power_long} if power else {},
+        }
+        self.debouncer.long_keys = {power} if power else set()
+
+    def on_key(self, key, repeat, timestamp, released=False):
+        if not repeat and not released:
+            self.main.cancel_timer()
+        self.handle(self.debouncer.feed(key, repeat, timestamp, released))
+        self.schedule_tick()
+
+    def schedule_tick(self):
+        if self.tick_timer is not None:
+            GObject.source_remove(self.tick_timer)
+            self.tick_timer = None
+        deadline = self.debouncer.next_deadline()
+        if deadline is not None:
+            delay = max(0, deadline - time.monotonic())
+            self.tick_timer = GObject.timeout_add(int(delay * 1000) + 1,
+                                                  self.on_tick)
+
+    def on_tick(self):
+        self.tick_timer = None
+        self.handle(self.debouncer.tick(time.monotonic()))
+        self.schedule_tick()
+        return False
+
+    def handle(self, events):
+        for kind, key in events:
+            log.debug('Key press: %s (%s), current frontend: %s', key,
+                      kind, self.main.current)
+            keymap = self.keymap.get(self.main.current)
+            if keymap is None:
+                if log.isEnabledFor(logging.DEBUG):
+                    # status() may ask the frontend, only do it when needed
+                    log.debug("keypress for other frontend")
+                    log.debug("current frontend is: %s", self.main.current)
+                    log.debug("vdrStatus is: %s", self.main.vdrStatus)
+                    log.debug("frontend status is: %s", self.main.status())
+                continue
+            if kind == 'long':
+                action = self.long_keymap[self.main.current].get(key)
+            else:
+                action = keymap.get(key, self.resume)
+            if action is not None:
+                self.queue(action)
+
+    def queue(self, action):
+        """run action on the main loop, an action that is already waiting
+        is not queued again, so a burst of keys results in one switch"""
+        if action in self.pending:
+            self.main.metrics.inc('keys_coalesced')
+            return
+        self.pending.append(action)
+        if self.dispatch_source is None:
+            self.dispatch_source = GObject.idle_add(self.run_pending)
+
+    def run_pending(self):
+        self.dispatch_source = None
+        pending, self.pending = self.pending, []
+        for action in pending:
+            with self.main.metrics.timed('key'):
+                action()
+        return False
+
+    def toggle(self):
+        log.debug("remote: toggleFrontend")
+        self.main.toggleFrontend()
+
+    def switch(self):
+        log.info("remote: switchFrontend")
+        self.main.switchFrontend()
+
+    def start_power_timer(self):
+        """detach if no other key is pressed within lirc_power_timeout"""
+        if self.power_timeout > 0:
+            self.main.timer = GObject.timeout_add_seconds(
+                self.power_timeout, self.main.soft_detach)
+
+    def vdr_power(self):
+        if self.main.status() == 1:
+            self.start_power_timer()
+        else:
+            self.main.send_shutdown()
+
+    def vdr_power_long(self):
+        if self.main.status() == 1:
+            self.main.soft_detach()
+        else:
+            self.main.send_shutdown()
+
+    def kodi_power(self):
+        if self.main.status() == 1:
+            self.main.wants_shutdown = True
+            self.main.init_shutdown()
+            self.start_power_timer()
+
+    def kodi_power_long(self):
+        if self.main.status() == 1:
+            self.main.wants_shutdown = True
+            self.main.init_shutdown()
+            self.main.soft_detach()
+
+    def resume(self):
+        status = self.main.status()
+        if status != 1:
+            log.debug("main status is: %s", status)
+            self.main.resume()
+        else:
+            log.debug("remote: no action necessary")
+
+    def close(self):
+        for backend in self.backends.values():
+            backend.close()
+        self.backends = {}
+        if self.tick_timer is not None:
+            GObject.source_remove(self.tick_timer)
+            self.tick_timer = None
+
+
+def replay(lines, debouncer):
+    """feed recorded '<timestamp> <key> press|repeat|release' lines to
+    debouncer and yield (timestamp, kind, key) for every press it reports"""
+    timestamp = 0.0
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3 or fields[0].startswith('#'):
+            continue
+        timestamp, key, event = float(fields[0]), fields[1], fields[2]
+        for kind, pressed in debouncer.feed(key, event == 'repeat',
+                                            timestamp, event == 'release'):
+            yield timestamp, kind, pressed
+    # let held keys run into the release timeout
+    deadline = debouncer.next_deadline()
+    if deadline is not None:
+        for kind, pressed in debouncer.tick(deadline):
+            yield deadline, kind, pressed
+
+
+if __name__ == '__main__':
+    # replay a recorded key stream, e.g. the output of tools/evdev_input.py
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin)
+    parser.add_argument('--debounce', type=float, default=0.3)
+    parser.add_argument('--long-press', type=float, default=1.0)
+    parser.add_argument('--release', type=float, default=0.6)
+    parser.add_argument('--long-key', action='append', default=[],
+                        help="key that distinguishes long presses")
+    args = parser.parse_args()
+    debouncer = KeyDebouncer(args.debounce, args.long_press, args.release,
+                             args.long_key)
+    for timestamp, kind, key in replay(args.file, debouncer):
+        print("{0:.3f} {1} {2}".format(timestamp, kind, key))
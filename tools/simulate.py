@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Run the frontend manager against stand-ins and benchmark it.
+
+    No VDR, KODI, lircd or system bus is needed: FakeDBus2VDR answers the
+    calls Main and the frontends make and emulates softhddevice's SVDRP
+    commands, keys are written to a fake lircd socket, KODI is replaced by
+    a small JSON-RPC server process and the D-Bus objects are exported on
+    a private dbus-daemon. Attach/detach, key press and switch cycles are
+    run through Main, throughput, latency percentiles and RSS growth are
+    reported for each of them:
+
+        python3 -m tools.simulate [--cycles N] [--switches N]
+'''
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIG = """
+[Logging]
+use_file = False
+loglevel = {loglevel}
+
+[Frontend]
+frontend = vdr
+attach = always
+DISPLAY = :0
+get_tempdisplay = true
+lirc_socket = {lirc_socket}
+lirc_toggle = KEY_PROG1
+lirc_switch = KEY_PROG2
+lirc_power = KEY_POWER2
+lirc_repeat = 0
+bg_renderer = feh
+
+[KODI]
+kodi = {python} {script} fake-kodi {port}
+rpc_port = {port}
+"""
+
+
+def fake_kodi(port):
+    """answer KODI JSON-RPC requests on port until Application.Quit"""
+    results = {
+        'JSONRPC.Ping': 'pong',
+        'Player.GetActivePlayers': [],
+        'Application.GetProperties': {'volume': 100, 'muted': False},
+    }
+    server = socket.create_server(('localhost', port))
+    decoder = json.JSONDecoder()
+    while True:
+        conn, address = server.accept()
+        buf = ''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            buf += data.decode()
+            while True:
+                buf = buf.lstrip()
+                try:
+                    request, end = decoder.raw_decode(buf)
+                except ValueError:
+                    break
+                buf = buf[end:]
+                method = request.get('method')
+                if 'id' in request:
+                    conn.sendall(json.dumps({
+                        'jsonrpc': '2.0', 'id': request['id'],
+                        'result': results.get(method, 'OK')}).encode())
+                if method == 'Application.Quit':
+                    conn.sendall(json.dumps({
+                        'jsonrpc': '2.0', 'method': 'System.OnQuit',
+                        'params': {'sender': 'xbmc',
+                                   'data': {'exitcode': 0}}}).encode())
+                    conn.close()
+                    sys.exit(0)
+        conn.close()
+
+
+class FakeRemote:
+    def __init__(self):
+        self.enabled = True
+        self.keys = []
+
+    def Enable(self):
+        self.enabled = True
+        return True
+
+    def Disable(self):
+        self.enabled = False
+        return True
+
+    def Status(self):
+        return self.enabled
+
+    def HitKey(self, key):
+        self.keys.append(key)
+        return True
+
+
+class FakeShutdown:
+    def ManualStart(self):
+        return True
+
+    def ConfirmShutdown(self, user=False):
+        return 990, "VDR is ready for shutdown"
+
+    def SetUserInactive(self):
+        return True
+
+
+class FakePlugins:
+    """answer softhddevice's SVDRP commands like the plugin does"""
+    codes = {0: 912, 1: 910, 2: 911}
+
+    def __init__(self):
+        self.state = 0  # 0=detached, 1=attached, 2=suspended
+        self.calls = 0
+
+    def SVDRPCommand(self, plugin, command, *args):
+        self.calls += 1
+        if plugin != 'softhddevice':
+            return 550, "unknown plugin {0}".format(plugin)
+        if command in ('atta', 'resu'):
+            self.state = 1
+        elif command == 'deta':
+            self.state = 0
+        elif command == 'susp':
+            self.state = 2
+        elif command == 'stat':
+            return self.codes[self.state], "state {0}".format(self.state)
+        return 900, "ok"
+
+
+class FakeDBus2VDR:
+    vdr_obj = 'de.tvdr.vdr'
+
+    def __init__(self, plugins):
+        self.Remote = FakeRemote()
+        self.Shutdown = FakeShutdown()
+        self.Plugins = plugins
+        self.signals = {}
+
+    def onSignal(self, name, callback):
+        self.signals[name] = callback
+
+    def checkVDRstatus(self):
+        return True
+
+
+class FakeLircd:
+    def __init__(self, path):
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(1)
+        self.client = None
+
+    def accept(self):
+        self.client, address = self.server.accept()
+
+    def send(self, key, repeat=0):
+        self.client.sendall(b"0000000000000001 %02x %s sim\n" % (
+            repeat, key.encode()))
+
+    def close(self):
+        if self.client:
+            self.client.close()
+        self.server.close()
+
+
+def get_rss():
+    """return the resident set size of this process in KiB"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def port_open(port):
+    try:
+        socket.create_connection(('localhost', port), 0.1).close()
+        return True
+    except OSError:
+        return False
+
+
+def report(name, latencies, duration, rss_before, rss_after):
+    if len(latencies) > 1:
+        p = statistics.quantiles(latencies, n=100)
+        p50, p90, p99 = p[49], p[89], p[98]
+    else:
+        p50 = p90 = p99 = latencies[0] if latencies else 0.0
+    print("{0:<14} {1:>6} {2:>8.2f} {3:>9.1f} {4:>8.2f} {5:>8.2f} {6:>8.2f} "
+          "{7:>8.2f} {8:>+9}".format(
+              name, len(latencies), duration, len(latencies) / duration,
+              p50 * 1e3, p90 * 1e3, p99 * 1e3,
+              max(latencies, default=0.0) * 1e3, rss_after - rss_before))
+
+
+def benchmark(args):
+    from gi.repository import GLib, GObject
+    import dbus.bus
+    import dbus.service
+    import frontend
+
+    class SimMain(frontend.Main):
+        def connect_dbus2vdr(self, **kwargs):
+            return FakeDBus2VDR(self.service.fake_plugins)
+
+        def get_plugins(self):
+            return {'softhddevice'}
+
+    class SimService(frontend.FrontendService):
+        def __init__(self, options, bus):
+            self.fake_plugins = FakePlugins()
+            super().__init__(options, bus)
+
+        def create_manager(self, instance):
+            return SimMain(self, instance)
+
+    context = GLib.MainContext.default()
+    # keep iteration() from blocking while waiting for a condition
+    GObject.timeout_add(5, lambda: True)
+
+    def run_until(condition, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise TimeoutError("simulation got stuck")
+            context.iteration(True)
+
+    def measure(name, count, step):
+        gc.collect()
+        rss = get_rss()
+        latencies = []
+        start = time.perf_counter()
+        for n in range(count):
+            latencies.append(step(n))
+        duration = time.perf_counter() - start
+        gc.collect()
+        report(name, latencies, duration, rss, get_rss())
+
+    tmpdir = tempfile.mkdtemp(prefix='frontend-sim-')
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork',
+                               '--print-address=1'],
+                              stdout=subprocess.PIPE)
+    lircd = None
+    service = None
+    vdr_name = None
+    try:
+        bus = dbus.bus.BusConnection(daemon.stdout.readline().decode().strip())
+        # Main takes vdr for stopped while nobody owns its bus name
+        vdr_name = dbus.service.BusName(FakeDBus2VDR.vdr_obj, bus)
+        lirc_socket = os.path.join(tmpdir, 'lircd')
+        lircd = FakeLircd(lirc_socket)
+        port = free_port()
+        config = os.path.join(tmpdir, 'frontend.conf')
+        with open(config, 'w') as f:
+            f.write(CONFIG.format(loglevel=args.loglevel,
+                                  lirc_socket=lirc_socket,
+                                  python=sys.executable,
+                                  script=os.path.abspath(__file__),
+                                  port=port))
+        service = SimService(argparse.Namespace(config=config,
+                                                profile_startup=False), bus)
+        service.loop = GObject.MainLoop()
+        lircd.accept()
+        main = service.managers[0]
+        idle = lambda: main.transitions.depth == 0
+
+        def attach_detach(n):
+            start = time.perf_counter()
+            if n % 2:
+                main.attach()
+            else:
+                main.detach()
+            run_until(idle)
+            return time.perf_counter() - start
+
+        def key(n):
+            histogram = main.metrics.histograms.get('key')
+            count = histogram.count if histogram else 0
+            start = time.perf_counter()
+            lircd.send('KEY_PROG1')
+            run_until(lambda: main.metrics.histograms.get('key') and
+                      main.metrics.histograms['key'].count > count and
+                      idle())
+            return time.perf_counter() - start
+
+        def switch(n):
+            start = time.perf_counter()
+            main.switchFrontend()
+            run_until(idle)
+            duration = time.perf_counter() - start
+            if main.current == 'kodi':
+                # quitting only works once the fake kodi listens
+                run_until(lambda: port_open(port))
+            return duration
+
+        print("{0:<14} {1:>6} {2:>8} {3:>9} {4:>8} {5:>8} {6:>8} {7:>8} "
+              "{8:>9}".format('phase', 'ops', 'total s', 'ops/s', 'p50 ms',
+                              'p90 ms', 'p99 ms', 'max ms', 'rss KiB'))
+        measure('attach/detach', args.cycles, attach_detach)
+        measure('key', args.cycles, key)
+        measure('switch', args.switches, switch)
+        print("svdrp commands: {0}".format(service.fake_plugins.calls))
+        for name in ('first_frame_softhddevice', 'first_frame_kodi'):
+            histogram = main.metrics.histograms.get(name)
+            if histogram:
+                print("{0}: p50 {1:.2f} ms, max {2:.2f} ms".format(
+                    name, histogram.percentile(50) * 1e3,
+                    histogram.max * 1e3))
+        for name in ('transitions_merged', 'keys_coalesced',
+                     'status_cache_hits', 'status_queries', 'state_signals'):
+            print("{0}: {1}".format(name, main.metrics.counters.get(name, 0)))
+    finally:
+        if service is not None:
+            service.shutdown()
+            service.executor.shutdown()
+        if lircd is not None:
+            lircd.close()
+        if vdr_name is not None:
+            # release the name while the bus is still there
+            del vdr_name
+        daemon.terminate()
+        daemon.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cycles', type=int, default=2000,
+                        help="attach/detach and key press cycles")
+    parser.add_argument('--switches', type=int, default=20,
+                        help="vdr <-> kodi switches")
+    parser.add_argument('--loglevel', default='WARNING')
+    parser.add_argument('mode', nargs='?', default='benchmark',
+                        choices=('benchmark', 'fake-kodi'))
+    parser.add_argument('port', nargs='?', type=int)
+    args = parser.parse_args()
+    if args.mode == 'fake-kodi':
+        fake_kodi(args.port)
+    else:
+        benchmark(args)
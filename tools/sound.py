@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Watch ALSA playback devices without forking fuser.
+
+    The holders of /dev/snd/pcm*p are found by scanning /proc/<pid>/fd.
+    Scans are driven by a GObject timeout, so the main loop keeps serving
+    D-Bus calls and lirc keys while a player releases the sound device.
+'''
+
+from gi.repository import GObject
+import logging
+import os
+import re
+import time
+log = logging.getLogger(__name__)
+
+PCM_PLAYBACK = re.compile(r'^/dev/snd/pcmC\d+D\d+p$')
+
+
+def get_comm(pid):
+    try:
+        with open('/proc/{0}/comm'.format(pid), 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def playback_holders(names=None, pids=None):
+    """return {pid: comm} of processes with an open playback device
+
+    If names is given, only processes whose comm starts with one of the
+    names are inspected, which saves reading the fds of all other processes.
+    If pids is given, only these processes are inspected.
+    """
+    holders = {}
+    if pids is None:
+        pids = os.listdir('/proc')
+    for pid in map(str, pids):
+        if not pid.isdigit():
+            continue
+        comm = get_comm(pid)
+        if comm is None:
+            continue
+        if names and not comm.startswith(tuple(names)):
+            continue
+        fd_dir = os.path.join('/proc', pid, 'fd')
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if PCM_PLAYBACK.match(target):
+                holders[int(pid)] = comm
+                break
+    return holders
+
+
+class SoundDeviceWatcher:
+    """wait for the processes called names or, if pids is given, the
+    processes pids() returns to close their playback devices"""
+    def __init__(self, names=('kodi',), interval=250, timeout=10, pids=None):
+        self.names = tuple(names)
+        self.pids = pids
+        self.interval = interval
+        self.timeout = timeout
+        self.timer = None
+        self.callbacks = []
+        self.deadline = None
+
+    def wait(self, callback, *args):
+        """call callback(free, *args) once no watched process holds a
+        playback device. free is False if the timeout expired first."""
+        self.callbacks.append((callback, args))
+        if self.timer is None:
+            self.deadline = time.monotonic() + self.timeout
+            if self.check():
+                self.timer = GObject.timeout_add(self.interval, self.check)
+
+    def cancel(self):
+        if self.timer is not None:
+            GObject.source_remove(self.timer)
+        self.timer = None
+        self.callbacks = []
+
+    def check(self):
+        if self.pids is not None:
+            holders = playback_holders(pids=self.pids())
+        else:
+            holders = playback_holders(self.names)
+        if holders and time.monotonic() < self.deadline:
+            log.debug("sound device still in use by %s", holders)
+            return True
+        if holders:
+            log.warning("sound device not freed after %ss: %s",
+                        self.timeout, holders)
+        else:
+            log.debug("sound device has been freed")
+        self.timer = None
+        callbacks, self.callbacks = self.callbacks, []
+        for callback, args in callbacks:
+            try:
+                callback(not holders, *args)
+            except Exception as error:
+                log.exception(error)
+        return False
+
+
+if __name__ == '__main__':
+    # measure how long the main loop stalls while a process holding a
+    # playback device is waited for: a timeout ticks every tick_ms and the
+    # largest gap between two ticks is reported
+    import argparse
+    import glob
+    import subprocess
+    import sys
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', help="playback device to hold")
+    parser.add_argument('--hold', type=float, default=3.0,
+                        help="seconds the device is held")
+    parser.add_argument('--tick', type=int, default=1, help="tick in ms")
+    args = parser.parse_args()
+    devices = [args.device] if args.device else sorted(
+        glob.glob('/dev/snd/pcmC*D*p'))
+    if not devices:
+        sys.exit("no playback device found, use --device")
+    holder = subprocess.Popen([
+        sys.executable, '-c',
+        'import os, sys, time; os.open(sys.argv[1], os.O_RDONLY | '
+        'os.O_NONBLOCK); time.sleep(float(sys.argv[2]))',
+        devices[0], str(args.hold)])
+    while holder.pid not in playback_holders():
+        if holder.poll() is not None:
+            sys.exit("could not open {0}".format(devices[0]))
+        time.sleep(0.01)
+    comm = get_comm(holder.pid)
+    loop = GObject.MainLoop()
+    ticks = []
+
+    def tick():
+        ticks.append(time.perf_counter())
+        return True
+
+    def on_free(free):
+        print("{0} (pid {1}) released {2}: {3}".format(
+            comm, holder.pid, devices[0], free))
+        loop.quit()
+
+    scans = []
+
+    class TimedWatcher(SoundDeviceWatcher):
+        def check(self):
+            start = time.perf_counter()
+            result = super().check()
+            scans.append(time.perf_counter() - start)
+            return result
+
+    GObject.timeout_add(args.tick, tick)
+    watcher = TimedWatcher(timeout=args.hold + 5,
+                           pids=lambda: [holder.pid])
+    GObject.idle_add(watcher.wait, on_free)
+    loop.run()
+    holder.wait()
+    gaps = sorted(b - a for a, b in zip(ticks, ticks[1:]))
+    print("{0} scans, longest {1:.3f} ms".format(len(scans),
+                                                 max(scans) * 1000))
+    print("{0} ticks of {1} ms: p50 gap {2:.3f} ms, p99 {3:.3f} ms, "
+          "max {4:.3f} ms".format(len(ticks), args.tick,
+                                  gaps[len(gaps) // 2] * 1000,
+                                  gaps[int(len(gaps) * 0.99)] * 1000,
+                                  gaps[-1] * 1000))
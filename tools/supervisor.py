@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Restart crashed player processes without running into a crash loop.
+
+    Every restart waits restart_backoff seconds, doubled for each crash in
+    a row up to restart_max_backoff. At most restart_budget restarts are
+    made within restart_window seconds, after that the supervisor gives up
+    until the window has passed. A process that ran for restart_window
+    seconds resets the backoff. The last exits are kept for getSupervisors.
+'''
+
+from gi.repository import GObject
+import collections
+import logging
+import os
+import signal
+import time
+log = logging.getLogger(__name__)
+
+Exit = collections.namedtuple('Exit', 'timestamp pid reason uptime')
+
+
+def describe(condition):
+    """return a readable reason for a wait status"""
+    if os.WIFSIGNALED(condition):
+        try:
+            name = signal.Signals(os.WTERMSIG(condition)).name
+        except ValueError:
+            name = str(os.WTERMSIG(condition))
+        return "killed by {0}".format(name)
+    return "exit code {0}".format(os.waitstatus_to_exitcode(condition))
+
+
+class RestartSupervisor:
+    def __init__(self, name, metrics, history=16):
+        self.name = name
+        self.metrics = metrics
+        self.exits = collections.deque(maxlen=history)
+        self.restarts = collections.deque()  # monotonic restart times
+        self.failures = 0  # crashes in a row
+        self.started_ts = None
+        self.timer = None
+        self.state = 'idle'  # idle, running, waiting, given up
+
+    def configure(self, settings):
+        self.backoff = settings.get_settingf('Frontend', 'restart_backoff',
+                                             1.0)
+        self.max_backoff = settings.get_settingf(
+            'Frontend', 'restart_max_backoff', 60.0)
+        self.budget = settings.get_settingi('Frontend', 'restart_budget', 5)
+        self.window = settings.get_settingf('Frontend', 'restart_window',
+                                            300.0)
+
+    def started(self):
+        self.started_ts = time.monotonic()
+        self.state = 'running'
+
+    def exited(self, pid, condition):
+        """record an exit and return its reason"""
+        now = time.monotonic()
+        uptime = now - self.started_ts if self.started_ts else 0.0
+        self.started_ts = None
+        reason = describe(condition)
+        self.exits.append(Exit(time.time(), pid, reason, uptime))
+        if self.state == 'running':
+            self.state = 'idle'
+        if uptime >= self.window:
+            self.failures = 0
+        log.debug("%s (pid %s) %s after %.1f s", self.name, pid, reason,
+                  uptime)
+        return reason
+
+    def restart(self, callback, *args):
+        """call callback(*args) after the backoff delay, return False if the
+        restart budget is used up"""
+        self.cancel()
+        now = time.monotonic()
+        while self.restarts and now - self.restarts[0] > self.window:
+            self.restarts.popleft()
+        if len(self.restarts) >= self.budget:
+            log.error("%s crashed %d times within %d s, giving up",
+                      self.name, len(self.restarts), self.window)
+            self.state = 'given up'
+            self.metrics.inc('restarts_given_up')
+            return False
+        delay = min(self.max_backoff, self.backoff * 2 ** self.failures)
+        self.failures += 1
+        self.restarts.append(now)
+        self.state = 'waiting'
+        self.metrics.inc('restarts')
+        log.info("restarting %s in %.1f s", self.name, delay)
+        self.timer = GObject.timeout_add(int(delay * 1000), self.on_timer,
+                                         callback, args)
+        return True
+
+    def on_timer(self, callback, args):
+        self.timer = None
+        self.state = 'idle'
+        callback(*args)
+        return False
+
+    def cancel(self):
+        """drop a pending restart"""
+        if self.timer is not None:
+            GObject.source_remove(self.timer)
+            self.timer = None
+            self.state = 'idle'
+
+    def status(self):
+        """return (state, crashes in a row, restarts in the window, exits)"""
+        now = time.monotonic()
+        restarts = sum(1 for ts in self.restarts if now - ts <= self.window)
+        exits = ["{0} pid {1}: {2} after {3:.1f} s".format(
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(e.timestamp)),
+            e.pid, e.reason, e.uptime) for e in self.exits]
+        return self.state, self.failures, restarts, exits
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+    Run frontend transitions (attach, detach, switch, ...) one at a time.
+
+    A transition that is requested while another one runs is queued. If
+    the same transition with the same arguments is already waiting, the
+    request is merged into it. A transition function that finishes in a
+    later callback returns PENDING and calls TransitionScheduler.finish
+    (or Transition.done) when it is complete; if that does not happen
+    within its timeout the transition is cancelled and the next one runs.
+    Such callbacks keep the running Transition (scheduler.current) and
+    check Transition.active, so a late callback can't finish a newer
+    transition.
+'''
+
+from gi.repository import GObject
+import collections
+import logging
+import time
+log = logging.getLogger(__name__)
+
+# returned by transition functions that complete asynchronously
+PENDING = object()
+
+
+class Transition:
+    def __init__(self, scheduler, name, func, args, timeout):
+        self.scheduler = scheduler
+        self.name = name
+        self.func = func
+        self.args = args
+        self.timeout = timeout
+        self.queued = time.monotonic()
+        self.cancelled = False
+        self.finished = False
+        self.result = None
+
+    @property
+    def active(self):
+        """False once the transition has been cancelled or finished"""
+        return not (self.cancelled or self.finished)
+
+    def done(self, result=None):
+        self.scheduler.finish(self, result)
+
+    def cancel(self):
+        """drop a waiting transition, a running one is treated as done"""
+        self.cancelled = True
+        self.scheduler.finish(self)
+
+
+class TransitionScheduler:
+    def __init__(self, metrics, timeout=30, on_finish=None):
+        self.metrics = metrics
+        self.timeout = timeout
+        # called with each transition that has run
+        self.on_finish = on_finish
+        self.queue = collections.deque()
+        self.current = None
+        self.timer = None
+        self.source = None
+
+    @property
+    def depth(self):
+        """number of queued and running transitions"""
+        return len(self.queue) + (self.current is not None)
+
+    def names(self):
+        running = [self.current.name] if self.current else []
+        return running + [transition.name for transition in self.queue]
+
+    def request(self, name, func, *args, timeout=None):
+        """queue func(*args), it runs right away if nothing else is going
+        on. Returns the Transition."""
+        for transition in self.queue:
+            if transition.name == name and transition.args == args:
+                log.debug("merged transition %s", name)
+                self.metrics.inc('transitions_merged')
+                return transition
+        transition = Transition(self, name, func, args,
+                                timeout or self.timeout)
+        self.queue.append(transition)
+        self.metrics.set('transition_queue_depth', self.depth)
+        if self.current is None and self.source is None:
+            self.run_next()
+        else:
+            log.debug("queued transition %s behind %s", name,
+                      self.names()[:-1])
+        return transition
+
+    def schedule(self):
+        if self.queue and self.current is None and self.source is None:
+            self.source = GObject.idle_add(self.run_next)
+
+    def run_next(self):
+        self.source = None
+        if self.current is not None or not self.queue:
+            return False
+        transition = self.current = self.queue.popleft()
+        self.metrics.observe('transition_wait',
+                             time.monotonic() - transition.queued)
+        log.debug("running transition %s", transition.name)
+        try:
+            result = transition.func(*transition.args)
+        except Exception as error:
+            log.exception(error)
+            result = None
+        if result is PENDING:
+            if not transition.finished:
+                self.timer = GObject.timeout_add_seconds(
+                    transition.timeout, self.on_timeout, transition)
+        else:
+            self.finish(transition, result)
+        return False
+
+    def on_timeout(self, transition):
+        self.timer = None
+        log.warning("transition %s did not finish within %s s",
+                    transition.name, transition.timeout)
+        self.metrics.inc('transition_timeouts')
+        transition.cancel()
+        return False
+
+    def finish(self, transition, result=None):
+        if transition.finished:
+            return
+        transition.finished = True
+        transition.result = result
+        if transition is self.current:
+            if self.timer is not None:
+                GObject.source_remove(self.timer)
+                self.timer = None
+            self.current = None
+            log.debug("transition %s finished", transition.name)
+            if self.on_finish is not None:
+                self.on_finish(transition)
+        elif transition in self.queue:
+            self.queue.remove(transition)
+        self.metrics.set('transition_queue_depth', self.depth)
+        self.schedule()
+
+    def finish_current(self, name):
+        """finish the running transition if it is called name"""
+        if self.current is not None and self.current.name == name:
+            self.finish(self.current)
+
+    def cancel_all(self):
+        """drop all waiting transitions"""
+        for transition in list(self.queue):
+            transition.cancel()